@@ -0,0 +1,187 @@
+### Libraries ###
+import sys
+import os
+import filecmp
+import functools
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+### Local Modules ###
+from batch import solve_batch_file
+
+# The test groups of AutoTest_08.py, in the same order
+TEST_GROUPS = [
+    ('A', ["a_Test_Circuit_1", "a_Test_Circuit_1BRX", "a_Test_Circuit_1dB", "a_Test_Circuit_1M", "a_Test_Circuit_1nF",
+           "a_Test_Circuit_1nT", "a_Test_Circuit_1Ord"]),
+    ('B', ["b_CR", "b_RC", "b_Pi_03", "b_Pi_03R", "b_Tee_03", "b_Tee_03R"]),
+    ('C', ["c_LCR", "c_LCG"]),
+    ('D', ["d_LPF_B50", "d_LPF_B75", "d_LPF_B750", "d_LPF_Bess350", "d_LPF_C550"]),
+    ('E', ["e_Ladder_100", "e_Ladder_400"]),
+]
+DIVIDER_LINE = '*' * 80
+
+def split_csv(text):
+    # Header lines and data rows of an output file. The rows are parsed into one float array
+    # when every row has the same number of values, otherwise (or if a value is malformed)
+    # None is returned in its place. Each line ends with a comma, so the last field is dropped.
+    lines = text.splitlines()
+    rows = [line.split(',')[:-1] for line in lines[2:]]
+    values = None
+    if rows and len({len(row) for row in rows}) == 1:
+        try:
+            values = np.array(rows, dtype=float)
+        except ValueError:
+            pass
+    return lines, values
+
+@functools.lru_cache(maxsize=None)
+def _load_model(path, mtime_ns, size):
+    with open(path, 'rt') as file:
+        return split_csv(file.read())
+
+def load_model(path):
+    # Parsed model file, cached per process for as long as the file is unchanged
+    stat = os.stat(path)
+    return _load_model(path, stat.st_mtime_ns, stat.st_size)
+
+def compare_chars(logfile, nline, l1, l2):
+    # Same messages as test_char_by_char() in AutoTest_08.py; True if the lines differ
+    if len(l1) != len(l2):
+        logfile.write("Line length differs, model file line has %d character while user file has %d\n" % (len(l1), len(l2)))
+        return True
+    if l1 == l2:
+        logfile.write("Line %d is OK\n" % nline)
+        return False
+    jjdiff = len(os.path.commonprefix([l1, l2]))
+    marker = "-" * (jjdiff + 4) + "^\n"
+    logfile.write("Error found in line %d from character %d\n" % (nline, jjdiff))
+    logfile.write("L1=<%s>\n%sL2=<%s>\n%s" % (l1, marker, l2, marker))
+    return True
+
+def compare_rows(logfile, nline, l1, l2, atol, rtol):
+    # Same messages as test_float_equality() in AutoTest_08.py for one pair of data lines
+    l1s, l2s = l1.split(','), l2.split(',')
+    if len(l1s) != len(l2s):
+        logfile.write("Line %d contains different number of floats, model has %d, user has %d\n" % (nline, len(l1s) - 1, len(l2s) - 1))
+        return True
+    v1, v2 = np.array(l1s[:-1], dtype=float), np.array(l2s[:-1], dtype=float)
+    return _log_row(logfile, nline, v1, v2, np.isclose(v1, v2, atol, rtol))
+
+def _log_row(logfile, nline, v1, v2, ok):
+    for ii in np.flatnonzero(~ok):
+        logfile.write("Line %d variable %d differs, model=%g, user=%g\n" % (nline, ii, v1[ii], v2[ii]))
+    if ok.all():
+        logfile.write("Line %d is OK\n" % nline)
+        return False
+    return True
+
+def compare_files(logfile, model, user_text, atol, rtol):
+    """
+    Compare a parsed model file with the text of a user file, writing the diagnostics of
+    test_equality() in AutoTest_08.py. The data rows are compared at once with np.isclose
+    over the parsed arrays; lines are only compared one by one when they differ.
+    Returns True if a difference is found.
+    """
+    model_lines, model_values = model
+    user_lines, user_values = split_csv(user_text)
+    if not (model_lines and user_lines and len(model_lines) == len(user_lines)):
+        logfile.write("Files have different number of lines, model has %d lines, user has %d lines\n" % (len(model_lines), len(user_lines)))
+        return True
+
+    logfile.write("Working on %d lines\n" % len(model_lines))
+    err_file = compare_chars(logfile, 1, model_lines[0], user_lines[0])
+    err_file = compare_chars(logfile, 2, model_lines[1], user_lines[1]) or err_file
+    if model_values is not None and user_values is not None and model_values.shape == user_values.shape:
+        # AutoTest_08.py calls np.isclose(v1, v2, atol, rtol), which passes atol as the
+        # relative tolerance and rtol as the absolute one; do the same so verdicts agree
+        close = np.isclose(model_values, user_values, atol, rtol)
+        rows_ok = close.all(axis=1)
+        for i, row_ok in enumerate(rows_ok):
+            if row_ok:
+                logfile.write("Line %d is OK\n" % (i + 3))
+            else:
+                _log_row(logfile, i + 3, model_values[i], user_values[i], close[i])
+                compare_chars(logfile, i + 3, model_lines[i + 2], user_lines[i + 2])
+        return err_file or not rows_ok.all()
+
+    for iline in range(2, len(model_lines)):
+        try:
+            float_err = compare_rows(logfile, iline + 1, model_lines[iline], user_lines[iline], atol, rtol)
+        except ValueError:
+            logfile.write("Line %d contains a value that is not a float\n" % (iline + 1))
+            float_err = True
+        if float_err:
+            compare_chars(logfile, iline + 1, model_lines[iline], user_lines[iline])
+        err_file = err_file or float_err
+    return err_file
+
+def run_case(job):
+    # Solve one test case in this process and compare it against its model file.
+    # Returns (basename, output_file, correct).
+    basename, user_dir, model_dir, atol, rtol = job
+    net_file = os.path.join(user_dir, basename + ".net")
+    output_file = os.path.join(user_dir, basename + ".csv")
+    model_file = os.path.join(model_dir, basename + "_model.csv")
+    _, status, seconds, messages = solve_batch_file((net_file, output_file, {}))
+    with open(os.path.join(user_dir, basename + "_run.log"), 'w') as run_log:
+        run_log.write(messages)
+
+    with open(os.path.join(user_dir, basename + "_compare.log"), 'wt') as cf_file:
+        cf_file.write("Solved %s in process: status %r after %.4f seconds\n" % (net_file, status, seconds))
+        if not os.path.exists(model_file) or not os.path.exists(output_file):
+            cf_file.write("Missing model file %s or output file %s\n" % (model_file, output_file))
+            return basename, output_file, False
+        same = filecmp.cmp(model_file, output_file)
+        cf_file.write("For files %s and %s filecmp returns same=%r\n" % (model_file, output_file, same))
+        if same:
+            return basename, output_file, True
+        cf_file.write("\t\t\tDetailed testing:\n")
+        with open(output_file, 'rt') as user:
+            unequal = compare_files(cf_file, load_model(model_file), user.read(), atol, rtol)
+    return basename, output_file, not unequal
+
+def run_autotest(atol, rtol, workers=None, user_dir='./User_files', model_dir='./Model_files', groups=TEST_GROUPS):
+    """
+    Run every test group across a pool of worker processes and print the summaries of
+    AutoTest_08.py. The _run.log and _compare.log files are written next to the outputs.
+    Returns the number of incorrect files.
+    """
+    t0 = time.time()
+    jobs = [(basename, user_dir, model_dir, atol, rtol) for _, names in groups for basename in names]
+    if workers is None or workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(run_case, jobs))
+    else:
+        outcomes = [run_case(job) for job in jobs]
+    correct = {basename: (output_file, ok) for basename, output_file, ok in outcomes}
+
+    correct_files = files_examined = 0
+    correct_list, incorrect_list = [], []
+    for group, names in groups:
+        clist = [correct[name][0] for name in names if correct[name][1]]
+        ilist = [correct[name][0] for name in names if not correct[name][1]]
+        print("%s\n%s_test: %d files tested, %d correct, %d incorrect" % (DIVIDER_LINE, group, len(names), len(clist), len(ilist)))
+        print("Correct files are:", clist)
+        print("Incorrect files are:", ilist)
+        print(DIVIDER_LINE)
+        correct_files += len(clist)
+        files_examined += len(names)
+        correct_list.append(clist)
+        incorrect_list.append(ilist)
+
+    incorrect_files = files_examined - correct_files
+    print("\n%s\n\t\tTotals\n%d files tested, %d correct, %d incorrect" % (DIVIDER_LINE, files_examined, correct_files, incorrect_files))
+    print("Correct files are:", correct_list)
+    print("Incorrect files are:", incorrect_list)
+    print(time.time() - t0, "seconds to run all tests")
+    print(DIVIDER_LINE)
+    return incorrect_files
+
+if __name__ == "__main__":
+    # python autotest.py Abs_tol Rel_tol [workers]
+    if len(sys.argv) < 3:
+        print("Command line should be:\npython autotest.py Abs_tol Rel_tol [workers]\n")
+        sys.exit(1)
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    sys.exit(1 if run_autotest(float(sys.argv[1]), float(sys.argv[2]), workers) else 0)
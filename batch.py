@@ -0,0 +1,48 @@
+### Libraries ###
+import contextlib
+import glob
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+### Local Modules ###
+from main import run_file
+
+def solve_batch_file(job):
+    # Solve one (input_file, output_file, settings) job, capturing what it prints
+    input_file, output_file, settings = job
+    messages = io.StringIO()
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(messages):
+        status = run_file(input_file, output_file, **settings)
+    return input_file, status, time.perf_counter() - t0, messages.getvalue()
+
+def run_batch(input_dir, out_dir=None, workers=None, **settings):
+    """
+    Solve every .net file in input_dir inside this process (or a pool of worker processes),
+    writing <name>.csv into out_dir, and print a per-file timing summary. settings are
+    passed on to main() for every file. Returns the number of files that failed.
+    """
+    net_files = sorted(glob.glob(os.path.join(input_dir, '*.net')))
+    out_dir = out_dir or input_dir
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(net_file, os.path.join(out_dir, os.path.basename(net_file)[:-4] + '.csv'), settings) for net_file in net_files]
+
+    t0 = time.perf_counter()
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(solve_batch_file, jobs))
+    else:
+        outcomes = [solve_batch_file(job) for job in jobs]
+    total = time.perf_counter() - t0
+
+    failed = 0
+    print("{:<40}{:>8}{:>12}".format("File", "Status", "Time (s)"))
+    for input_file, status, seconds, messages in outcomes:
+        failed += status != 0
+        print("{:<40}{:>8}{:>12.4f}".format(os.path.basename(input_file), "ok" if status == 0 else "failed", seconds))
+        for line in messages.splitlines():
+            print("    " + line)
+    print("{} files solved, {} failed, {:.4f} seconds in total".format(len(outcomes), failed, total))
+    return failed
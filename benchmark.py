@@ -0,0 +1,217 @@
+### Libraries ###
+import sys
+import os
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import numpy as np
+
+### Local Modules ###
+from matrix_calculations import (cascade_ladder, cascade_matrix_stacks, cascade_tree, impedance_matrices,
+                                 impedance_matrix, cascade_matrices, calculate_output_variables)
+from net_parser import parse_net_file, parse_component, parse_net_stream
+from csv_writer import write_csv_header, write_csv_data_row, write_csv_data_block
+
+# Stage benchmark grid: generated ladders and sweep lengths from 10 to 10**6
+STAGE_SECTIONS = [10, 100, 1000, 10**4, 10**5, 10**6]
+STAGE_NFREQS = [10, 100, 1000, 10**4, 10**5, 10**6]
+# Largest components x frequencies product solved by the vectorised and per-frequency paths
+SOLVE_LIMIT = 10**8
+PER_FREQUENCY_LIMIT = 10**6
+# Outputs written by the write stages, as in a_Test_Circuit_1dB.net
+STAGE_OUTPUTS = [('Vin', 'dBV'), ('Vout', 'dBV'), ('Iin', 'dBA'), ('Iout', 'A'), ('Pin', 'dBW'),
+                 ('Zout', 'Ohms'), ('Pout', 'W'), ('Zin', 'Ohms'), ('Av', 'dB'), ('Ai', 'L')]
+# Start-up benchmark: command-line runs on small generated ladders, as (sections, nfreqs)
+STARTUP_CIRCUITS = [(1, 10), (1, 50), (10, 50), (100, 200), (1000, 200)]
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+# Relative slow-down counted as a regression, and the smallest change (seconds) worth reporting
+REGRESSION_THRESHOLD = 0.2
+NOISE_FLOOR = 1e-3
+
+def generate_ladder(n_sections, series=('L', 1.0e-4), shunt=('C', 1.0e-9)):
+    # Synthetic e_Ladder_400 style circuit: a series element then a shunt element per section
+    components = []
+    for node in range(1, n_sections + 1):
+        components.append((node, node + 1, series[0], series[1]))
+        components.append((node + 1, 0, shunt[0], shunt[1]))
+    return components
+
+def time_call(function, *args, **kwargs):
+    # Wall time of a single call and its result
+    t0 = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - t0, result
+
+def bench_cascade(n_sections, n_freqs, workers=None):
+    # Compare the sequential fold against the tree-reduction cascade on one generated ladder
+    components = generate_ladder(n_sections)
+    frequencies = np.linspace(10.0, 1.0e6, n_freqs)
+
+    t_fold, fold = time_call(cascade_matrix_stacks, (impedance_matrices(frequencies, *c) for c in components))
+    t_ladder, _ = time_call(cascade_ladder, frequencies, components)
+    t_tree, (tree, exponent) = time_call(cascade_tree, frequencies, components, return_exponent=True)
+    t_pool, _ = time_call(cascade_tree, frequencies, components, workers=workers, return_exponent=True)
+
+    # Compare only where the sequential fold did not overflow
+    with np.errstate(over='ignore', invalid='ignore'):
+        tree_total = tree * np.exp2(exponent)[..., np.newaxis, np.newaxis]
+    finite = np.isfinite(fold).all(axis=(-2, -1)) & np.isfinite(tree_total).all(axis=(-2, -1))
+    agree = bool(np.allclose(fold[finite], tree_total[finite], rtol=1e-6, atol=0))
+
+    return {'sections': n_sections, 'nfreqs': n_freqs, 'fold': t_fold, 'ladder': t_ladder,
+            'tree': t_tree, 'tree_pool': t_pool, 'workers': workers, 'agree': agree,
+            'fold_overflow': int((~np.isfinite(fold).all(axis=(-2, -1))).sum())}
+
+def write_ladder_net(path, components, n_freqs, output_data=STAGE_OUTPUTS):
+    # Write a generated circuit as a .net file with a linear sweep of n_freqs points
+    with open(path, 'w') as file:
+        file.write("<CIRCUIT>\n")
+        file.writelines(f"n1={n1} n2={n2} {ctype}={value:g}\n" for n1, n2, ctype, value in components)
+        file.write("</CIRCUIT>\n<TERMS>\nVT=5 RS=50\nRL=75\n")
+        file.write(f"Fstart=10.0 Fend=1e6 Nfreqs={n_freqs}\n</TERMS>\n<OUTPUT>\n")
+        file.writelines(f"{name} {unit}\n" for name, unit in output_data)
+        file.write("</OUTPUT>\n")
+
+def best_time(function, *args, min_total=0.2, max_runs=5):
+    # Best wall time of repeated calls, repeating short calls until min_total seconds have passed
+    times = []
+    while len(times) < max_runs and (not times or sum(times) < min_total):
+        times.append(time_call(function, *args)[0])
+    return min(times)
+
+def solve_per_frequency(frequencies, components):
+    # The original solve: one impedance_matrix()/cascade_matrices() cascade per frequency
+    return [cascade_matrices([impedance_matrix(f, *c) for c in components]) for f in frequencies]
+
+def write_rows(path, frequencies, output_data, results):
+    # The original writer: header then one write_csv_data_row() call per frequency
+    with open(path, 'w') as csvfile:
+        write_csv_header(csvfile, output_data)
+        for i, f in enumerate(frequencies):
+            write_csv_data_row(csvfile, f, output_data, {name: value[i] for name, value in results.items()})
+
+def write_block(path, frequencies, output_data, results):
+    with open(path, 'w') as csvfile:
+        write_csv_header(csvfile, output_data)
+        write_csv_data_block(csvfile, frequencies, output_data, results)
+
+def bench_stages(sections=STAGE_SECTIONS, nfreqs=STAGE_NFREQS, solve_limit=SOLVE_LIMIT,
+                 per_frequency_limit=PER_FREQUENCY_LIMIT, log=print):
+    """
+    Time the parse, solve and write stages separately on generated ladders. Parse stages
+    depend only on the ladder size and write stages only on the sweep length; solve stages
+    are timed for every combination within the components x frequencies limits.
+    Returns a list of {'stage', 'sections', 'nfreqs', 'seconds'} records.
+    """
+    records = []
+
+    def record(stage, n_sections, n_freqs, seconds):
+        records.append({'stage': stage, 'sections': n_sections, 'nfreqs': n_freqs, 'seconds': seconds})
+        log("{:<22}{:>10}{:>10}{:>12.5f}".format(stage, n_sections or '-', n_freqs or '-', seconds))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        net_path = os.path.join(tmp, 'ladder.net')
+        for n_sections in sections:
+            components = generate_ladder(n_sections)
+            write_ladder_net(net_path, components, 10)
+            record('parse_net_file', n_sections, None, best_time(parse_net_file, net_path))
+            circuit_data = parse_net_file(net_path)[0]
+            record('parse_component', n_sections, None,
+                   best_time(lambda: [parse_component(line, None) for line in circuit_data]))
+            record('parse_net_stream', n_sections, None, best_time(parse_net_stream, net_path))
+
+            for n_freqs in nfreqs:
+                frequencies = np.linspace(10.0, 1.0e6, n_freqs)
+                work = len(components) * n_freqs
+                if work <= per_frequency_limit:
+                    record('solve_per_frequency', n_sections, n_freqs, best_time(solve_per_frequency, frequencies, components))
+                if work <= solve_limit:
+                    record('solve_ladder', n_sections, n_freqs, best_time(cascade_ladder, frequencies, components))
+
+        # The written text does not depend on the circuit, so the write stages use a small one
+        components = generate_ladder(10)
+        csv_path = os.path.join(tmp, 'ladder.csv')
+        for n_freqs in nfreqs:
+            frequencies = np.linspace(10.0, 1.0e6, n_freqs)
+            total_matrices = cascade_ladder(frequencies, components)
+            record('outputs', None, n_freqs, best_time(calculate_output_variables, total_matrices, 5, 50, 75, STAGE_OUTPUTS))
+            results = calculate_output_variables(total_matrices, 5, 50, 75, STAGE_OUTPUTS)
+            record('write_csv_data_row', None, n_freqs, best_time(write_rows, csv_path, frequencies, STAGE_OUTPUTS, results))
+            record('write_csv_data_block', None, n_freqs, best_time(write_block, csv_path, frequencies, STAGE_OUTPUTS, results))
+    return records
+
+def run_command(*args):
+    # One fresh interpreter running args, as a user starts it from the shell
+    subprocess.run([sys.executable, *args], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def bench_startup(circuits=STARTUP_CIRCUITS, log=print):
+    """
+    Time whole command-line runs of main.py, start-up included, on small generated ladders,
+    next to the start-up of a bare interpreter and of one that only imports NumPy. Returns
+    records in the format of bench_stages().
+    """
+    records = []
+
+    def record(stage, n_sections, n_freqs, seconds):
+        records.append({'stage': stage, 'sections': n_sections, 'nfreqs': n_freqs, 'seconds': seconds})
+        log("{:<22}{:>10}{:>10}{:>12.5f}".format(stage, n_sections or '-', n_freqs or '-', seconds))
+
+    record('startup_python', None, None, best_time(run_command, '-c', 'pass'))
+    record('startup_numpy', None, None, best_time(run_command, '-c', 'import numpy'))
+    with tempfile.TemporaryDirectory() as tmp:
+        net_path, csv_path = os.path.join(tmp, 'ladder.net'), os.path.join(tmp, 'ladder.csv')
+        for n_sections, n_freqs in circuits:
+            write_ladder_net(net_path, generate_ladder(n_sections), n_freqs)
+            record('startup_main', n_sections, n_freqs, best_time(run_command, MAIN_SCRIPT, net_path, csv_path))
+    return records
+
+def compare_stages(records, baseline, threshold=REGRESSION_THRESHOLD, noise_floor=NOISE_FLOOR):
+    # Records more than threshold slower than the matching baseline record (and by more than
+    # noise_floor seconds), as (record, baseline seconds) pairs
+    key = lambda r: (r['stage'], r['sections'], r['nfreqs'])
+    reference = {key(r): r['seconds'] for r in baseline}
+    regressions = []
+    for r in records:
+        before = reference.get(key(r))
+        if before is not None and r['seconds'] > before * (1 + threshold) and r['seconds'] - before > noise_floor:
+            regressions.append((r, before))
+    return regressions
+
+def main_stages(args):
+    # python benchmark.py stages results.json [baseline.json [threshold]]
+    # Exits with status 1 if any stage regressed against the baseline
+    if not args:
+        raise SystemExit("Usage: python benchmark.py stages results.json [baseline.json [threshold]]")
+    print("{:<22}{:>10}{:>10}{:>12}".format("stage", "sections", "nfreqs", "seconds"))
+    records = bench_startup() + bench_stages()
+    with open(args[0], 'w') as file:
+        json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'results': records}, file, indent=1)
+    if len(args) < 2:
+        return 0
+
+    with open(args[1]) as file:
+        baseline = json.load(file)['results']
+    threshold = float(args[2]) if len(args) > 2 else REGRESSION_THRESHOLD
+    regressions = compare_stages(records, baseline, threshold)
+    for r, before in regressions:
+        print("Regression: {} sections={} nfreqs={}: {:.5f} s against {:.5f} s".format(
+            r['stage'], r['sections'], r['nfreqs'], r['seconds'], before))
+    print("{} regressions beyond {:.0%}".format(len(regressions), threshold))
+    return 1 if regressions else 0
+
+def main(args):
+    # python benchmark.py [workers] [sections ...]
+    workers = int(args[0]) if args else 4
+    sizes = [int(float(a)) for a in args[1:]] or [1000, 10000, 100000]
+    print("  sections  nfreqs      fold    ladder      tree  tree_pool  agree  fold_overflow")
+    for n_sections in sizes:
+        r = bench_cascade(n_sections, 256, workers)
+        print("{:>10}{:>8}{:>10.3f}{:>10.3f}{:>10.3f}{:>11.3f}{:>7}{:>15}".format(
+            r['sections'], r['nfreqs'], r['fold'], r['ladder'], r['tree'], r['tree_pool'], str(r['agree']), r['fold_overflow']))
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['stages']:
+        sys.exit(main_stages(sys.argv[2:]))
+    main(sys.argv[1:])
@@ -0,0 +1,69 @@
+### Libraries ###
+import numpy as np
+
+### Local Modules ###
+from csv_writer import output_columns
+
+class BinaryWriter:
+    """
+    Binary output backend for .npy and .npz files, holding the same columns as the CSV
+    (frequency first) as float64 values.
+
+    .npy: a structured array with one record per frequency and one field per column,
+          named "header [unit]", e.g. "Re(Vin) [V]". It can be opened with
+          np.load(path, mmap_mode='r'). When the number of rows is known up front the
+          header is written first and each block is appended to the file as it arrives,
+          so sweeps larger than memory can be written; otherwise blocks are gathered and
+          written in one call on close.
+    .npz: 'data', an (Nfreqs, Ncolumns) array, with the column 'headers' and 'units',
+          gathered and written in one call on close.
+    """
+
+    def __init__(self, output_file, output_data, rows=None):
+        self.output_file = output_file
+        self.output_data = output_data
+        headers, units, _ = output_columns(output_data, {name: 0j for name, _ in output_data})
+        self.headers = ['Freq'] + headers
+        self.units = ['Hz'] + units
+        self.names = [f"{header} [{unit}]" for header, unit in zip(self.headers, self.units)]
+        self.dtype = np.dtype([(name, '<f8') for name in self.names])
+        self.blocks = []
+        self.file = None
+        if rows is not None and not output_file.endswith('.npz'):
+            self.file = open(output_file, 'wb')
+            header = {'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False, 'shape': (rows,)}
+            np.lib.format.write_array_header_2_0(self.file, header)
+
+    def write_block(self, frequencies, results):
+        _, _, columns = output_columns(self.output_data, results)
+        frequencies = np.asarray(frequencies, dtype=float)
+        columns = [frequencies] + [np.broadcast_to(c, frequencies.shape) for c in columns]
+        if self.file is None:
+            self.blocks.append(np.column_stack(columns))
+            return
+        records = np.empty(len(frequencies), dtype=self.dtype)
+        for name, column in zip(self.names, columns):
+            records[name] = column
+        self.file.write(records.tobytes())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            return
+        data = np.concatenate(self.blocks) if self.blocks else np.empty((0, len(self.headers)))
+        if self.output_file.endswith('.npz'):
+            np.savez(self.output_file, data=data, headers=np.array(self.headers), units=np.array(self.units))
+        else:
+            records = np.empty(len(data), dtype=self.dtype)
+            for i, name in enumerate(self.names):
+                records[name] = data[:, i]
+            # np.save on an open file keeps the exact file name (it appends .npy to bare paths)
+            with open(self.output_file, 'wb') as file:
+                np.save(file, records)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,240 @@
+### Libraries ###
+import hashlib
+import os
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+import numpy as np
+
+### Local Modules ###
+from component_table import ComponentTable, COMPONENT_DTYPE
+
+# Bump when the layout of a cache entry changes so old entries are ignored
+CACHE_VERSION = 2
+DEFAULT_CACHE_MB = 256
+DEFAULT_MEMORY_ENTRIES = 256
+DEFAULT_RESPONSE_MB = 256
+
+class CircuitCache:
+    """
+    On-disk cache of compiled circuits keyed by the hash of the netlist's CIRCUIT block
+    (see scan_net_file()). Each entry is one .npz file holding the sorted component table
+    and, for ladders, its sections as fold_constant_runs() gives them, with the constant
+    R/G run products already multiplied out.
+    Entries are written atomically and evicted least recently used first once the
+    directory grows past max_mb, so several processes can share one cache directory.
+    """
+
+    def __init__(self, directory, max_mb=DEFAULT_CACHE_MB):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 2**20)
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.directory, f"{digest}.v{CACHE_VERSION}.npz")
+
+    def load(self, digest):
+        # The cached (sorted ComponentTable, folded sections or None), or None on a miss
+        path = self.path(digest)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+            records = arrays['components']
+            # Mark the entry as recently used for the LRU eviction
+            os.utime(path)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            # Missing, evicted by another process or unreadable: treat as a miss
+            return None
+        if records.dtype != COMPONENT_DTYPE:
+            return None
+        return ComponentTable(records), _unpack_sections(arrays)
+
+    def store(self, digest, table, folded=None):
+        # Write to a temporary file and rename it into place, so readers never see a partial entry.
+        # folded is the (sections, saved) result of fold_constant_runs() for ladders.
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                np.savez(file, components=table.records, **_pack_sections(folded))
+            os.replace(temp_path, self.path(digest))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        # Remove least recently used entries until the cache fits in max_bytes
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass    # Already evicted by another process
+            total -= size
+
+class MemoryCircuitCache:
+    """
+    In-process counterpart of CircuitCache for long-running processes: the sorted component
+    tables and folded sections of the max_entries most recently used circuits are kept in
+    memory, keyed by the same CIRCUIT block hash. Safe to share between threads.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def load(self, digest):
+        # The cached (sorted ComponentTable, folded sections or None), or None on a miss
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is not None:
+                self.entries.move_to_end(digest)
+            return entry
+
+    def store(self, digest, table, folded=None):
+        with self.lock:
+            self.entries[digest] = (table, folded)
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+def _pack_sections(folded):
+    # Arrays of an entry for the (sections, saved) of fold_constant_runs(): the kind of each
+    # section (0 for a component, 1 for a folded matrix), the component records and the matrices
+    if folded is None:
+        return {}
+    sections, saved = folded
+    matrices = [section for section in sections if isinstance(section, np.ndarray)]
+    components = [section for section in sections if not isinstance(section, np.ndarray)]
+    return {'section_kinds': np.array([isinstance(section, np.ndarray) for section in sections], dtype=np.uint8),
+            'section_components': ComponentTable.from_tuples(components).records,
+            'folded': np.array(matrices, dtype=complex).reshape(-1, 2, 2), 'saved': np.array(saved)}
+
+def _unpack_sections(arrays):
+    # The (sections, saved) packed by _pack_sections(), or None if the entry has none
+    if 'section_kinds' not in arrays:
+        return None
+    components, matrices = iter(ComponentTable(arrays['section_components'])), iter(arrays['folded'])
+    sections = [next(matrices) if kind else next(components) for kind in arrays['section_kinds'].tolist()]
+    return sections, int(arrays['saved'])
+
+def circuit_digest(table):
+    # Hash of a sorted ComponentTable, the same for any netlist text giving the same circuit
+    return hashlib.sha256(table.records.tobytes()).hexdigest()
+
+class ResponseCache:
+    """
+    Memo of solved ABCD matrices keyed by circuit (see circuit_digest()) and exact frequency
+    value, so a sweep overlapping earlier sweeps of the same circuit only solves the
+    frequencies not seen before. Every frequency is solved independently of the others, so
+    remembered matrices are exactly those a fresh solve would give. Circuits are evicted least
+    recently used first once the matrices held pass max_mb. With a path the memo is read from
+    that .npz file when created and written back by save(). Safe to share between threads.
+    """
+
+    def __init__(self, path=None, max_mb=DEFAULT_RESPONSE_MB):
+        self.path = path
+        self.max_bytes = int(max_mb * 2**20)
+        self.entries = OrderedDict()    # digest -> (sorted frequencies, ABCD matrices)
+        self.nbytes = 0
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.read(path)
+
+    def solve(self, digest, frequencies, solve, solved=None):
+        """
+        ABCD matrices of the circuit digest at frequencies, as an (Nfreqs, 2, 2) array. The
+        frequencies missing from the memo are solved, once each and in ascending order, by
+        solve(missing) and remembered. With a list solved, the newly solved (frequencies,
+        matrices) are appended to it instead, for the caller to store() in one merge.
+        """
+        frequencies = np.asarray(frequencies, dtype=float)
+        with self.lock:
+            known, known_matrices = self.entries.get(digest, (np.empty(0), None))
+            if digest in self.entries:
+                self.entries.move_to_end(digest)
+        index = np.minimum(np.searchsorted(known, frequencies), max(len(known) - 1, 0))
+        found = known[index] == frequencies if len(known) else np.zeros(len(frequencies), dtype=bool)
+        matrices = np.empty((len(frequencies), 2, 2), dtype=complex)
+        if found.any():
+            matrices[found] = known_matrices[index[found]]
+        missing = ~found
+        if missing.any():
+            new = np.unique(frequencies[missing])
+            new_matrices = solve(new)
+            matrices[missing] = new_matrices[np.searchsorted(new, frequencies[missing])]
+            if solved is None:
+                self.store(digest, new, new_matrices)
+            else:
+                solved.append((new, new_matrices))
+        with self.lock:
+            self.hits += int(found.sum())
+            self.misses += int(missing.sum())
+        return matrices
+
+    def store(self, digest, frequencies, matrices):
+        # Merge solved matrices into the circuit's entry, then evict down to max_bytes
+        with self.lock:
+            if digest in self.entries:
+                known, known_matrices = self.entries.pop(digest)
+                self.nbytes -= known.nbytes + known_matrices.nbytes
+                frequencies = np.concatenate((known, frequencies))
+                matrices = np.concatenate((known_matrices, matrices))
+            frequencies, first = np.unique(frequencies, return_index=True)
+            matrices = matrices[first]
+            self.entries[digest] = (frequencies, matrices)
+            self.nbytes += frequencies.nbytes + matrices.nbytes
+            while self.nbytes > self.max_bytes and self.entries:
+                _, (known, known_matrices) = self.entries.popitem(last=False)
+                self.nbytes -= known.nbytes + known_matrices.nbytes
+
+    def read(self, path):
+        # Merge the entries of a memo file, least recently used first; unreadable files are ignored
+        try:
+            with np.load(path, allow_pickle=False) as memo:
+                if int(memo['version']) != CACHE_VERSION:
+                    return
+                digests = memo['digests'].tolist()
+                for i, digest in enumerate(digests):
+                    self.store(digest, memo[f'frequencies{i}'], memo[f'matrices{i}'])
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            pass
+
+    def save(self, path=None):
+        # Write the memo to path (by default the one it was read from), atomically
+        path = path or self.path
+        with self.lock:
+            entries = list(self.entries.items())
+        arrays = {'version': np.array(CACHE_VERSION), 'digests': np.array([digest for digest, _ in entries], dtype=str)}
+        for i, (_, (frequencies, matrices)) in enumerate(entries):
+            arrays[f'frequencies{i}'] = frequencies
+            arrays[f'matrices{i}'] = matrices
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                np.savez(file, **arrays)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def report(self):
+        # Hit and miss counts (in frequencies) and the size of the memo
+        print(f"Response cache: {self.hits} hits, {self.misses} misses, "
+              f"{len(self.entries)} circuits in {self.nbytes / 2**20:.3f} MB")
@@ -0,0 +1,90 @@
+### Libraries ###
+import numpy as np
+
+### Local Modules ###
+from net_parser import COMPONENT_TYPES
+
+# One packed record per component: 17 bytes instead of a tuple of Python objects
+COMPONENT_DTYPE = np.dtype([('n1', '<i4'), ('n2', '<i4'), ('code', 'u1'), ('value', '<f8')])
+
+class ComponentTable:
+    """
+    Compact, array-backed list of components. Each record holds the two node numbers, the
+    component type code (an index into COMPONENT_TYPES) and the value. Iterating over the
+    table yields the same (n1, n2, ctype, value) tuples as parse_component().
+    """
+
+    def __init__(self, records=None):
+        self.records = np.zeros(0, dtype=COMPONENT_DTYPE) if records is None else records
+
+    @classmethod
+    def from_arrays(cls, n1s, n2s, codes, values):
+        # Build the table from the typed columns returned by parse_net_lines()
+        records = np.empty(len(n1s), dtype=COMPONENT_DTYPE)
+        records['n1'] = n1s
+        records['n2'] = n2s
+        records['code'] = codes
+        records['value'] = values
+        return cls(records)
+
+    @classmethod
+    def from_tuples(cls, components):
+        # Build the table from (n1, n2, ctype, value) tuples
+        components = list(components)
+        return cls.from_arrays([c[0] for c in components], [c[1] for c in components],
+                               [COMPONENT_TYPES.index(c[2]) for c in components], [c[3] for c in components])
+
+    @property
+    def n1(self):
+        return self.records['n1']
+
+    @property
+    def n2(self):
+        return self.records['n2']
+
+    @property
+    def codes(self):
+        return self.records['code']
+
+    @property
+    def values(self):
+        return self.records['value']
+
+    @property
+    def types(self):
+        # Component type letters as an array of strings
+        return np.array(list(COMPONENT_TYPES))[self.codes]
+
+    @property
+    def shunt(self):
+        # Mask of components connected to the common node
+        return self.n2 == 0
+
+    def mask(self, component_type):
+        # Mask of the components of one type ('R', 'L', 'C' or 'G')
+        return self.codes == COMPONENT_TYPES.index(component_type)
+
+    def sorted(self):
+        # Stable sort on (n1, n2), the order sorted(..., key=lambda x: (x[0], x[1])) gives
+        return ComponentTable(self.records[np.lexsort((self.n2, self.n1))])
+
+    @property
+    def nbytes(self):
+        return self.records.nbytes
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        # Slices give a table, single indices a (n1, n2, ctype, value) tuple
+        if isinstance(index, slice):
+            return ComponentTable(self.records[index])
+        n1, n2, code, value = self.records[index].tolist()
+        return n1, n2, COMPONENT_TYPES[code], value
+
+    def __iter__(self):
+        types = [COMPONENT_TYPES[code] for code in self.codes.tolist()]
+        return zip(self.n1.tolist(), self.n2.tolist(), types, self.values.tolist())
+
+    def __repr__(self):
+        return f"ComponentTable({len(self)} components)"
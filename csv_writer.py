@@ -1,5 +1,18 @@
 import math
 
+# Output file extensions written by binary_writer.BinaryWriter; anything else is written as CSV
+BINARY_EXTENSIONS = ('.npy', '.npz')
+
+def db_unit(name):
+    # Unit of a dB column: dBV for voltages, dBA for currents, dBW for powers and dB otherwise
+    if "Vout" in name or "Vin" in name:
+        return "dBV"
+    elif "Iout" in name or "Iin" in name:
+        return "dBA"
+    elif "Pout" in name or "Pin" in name:
+        return "dBW"
+    return "dB"
+
 def write_csv_header(csvfile, output_data):
     headers = ['      Freq']
     units = ['        Hz']
@@ -11,22 +24,13 @@ def write_csv_header(csvfile, output_data):
 
         # Handling different unit types with specific formatting
         if "dB" in unit:
-            if "Vout" in header or "Vin" in header:
-                db_unit = "dBV"
-            elif "Iout" in header or "Iin" in header:
-                db_unit = "dBA"
-            elif "Pout" in header or "Pin" in header:
-                db_unit = "dBW"
-            else:
-                db_unit = "dB"
-            
             # Splitting magnitude and phase into separate columns
             magnitude_header = "{:>11}".format("|" + header + "|")
             phase_header = "{:>11}".format("/_" + header)
             headers.extend([magnitude_header, phase_header])
             
             # dBV/dBA/dB and Rads as units for magnitude and phase respectively
-            units.extend(["{:>11}".format(db_unit), "{:>11}".format("Rads")])
+            units.extend(["{:>11}".format(db_unit(header)), "{:>11}".format("Rads")])
         else:
             # Splitting real and imaginary parts into separate columns
             real_header = "{:>11}".format("Re(" + header + ")")
@@ -71,6 +75,87 @@ def write_csv_data_row(csvfile, f, output_data, results):
     # Join the rest of the row with commas and write to file
     csvfile.write(",".join(row) + "\n")
 
+def csv_data_columns(frequencies, output_data, results):
+    # The data columns written for a block of frequencies, in output order, as lists of floats.
+    # results maps each output variable to an array with one value per frequency.
+    # NumPy is imported here, not by the module, so main.py can start up without it.
+    import numpy as np
+    columns = [np.asarray(frequencies, dtype=float).tolist()]
+    for name, unit in output_data:
+        if 'dB' in unit:
+            values = np.broadcast_to(results.get(name, 0), np.shape(frequencies))
+            # abs() and math.log10() per value, as in write_csv_data_row(), so the digits are identical
+            magnitudes = map(abs, np.asarray(values, dtype=complex).tolist())
+            columns.append([20 * math.log10(m) if m > 0 else 0 for m in magnitudes])
+        else:
+            values = np.broadcast_to(results[name], np.shape(frequencies))
+            columns.append(np.real(values).tolist())
+            columns.append(np.imag(values).tolist())
+    return columns
+
+def output_columns(output_data, results):
+    # Headers, units and values of the data columns for a block of results, computed on whole
+    # arrays: |x| in dB for dB units (0 where |x| is 0), otherwise the real and imaginary parts
+    import numpy as np
+    headers, units, columns = [], [], []
+    for name, unit in output_data:
+        if 'dB' in unit:
+            magnitude = np.abs(results.get(name, 0))
+            with np.errstate(divide='ignore'):
+                columns.append(np.where(magnitude > 0, 20 * np.log10(magnitude), 0))
+            headers.append("|" + name + "|")
+            units.append(db_unit(name))
+        else:
+            columns.extend([np.real(results[name]), np.imag(results[name])])
+            headers.extend(["Re(" + name + ")", "Im(" + name + ")"])
+            units.extend([unit or "L", unit or "L"])
+    return headers, units, columns
+
+def write_csv_data_block(csvfile, frequencies, output_data, results, block_rows=65536):
+    """
+    Write the data rows for a whole block of frequencies. Produces exactly the same text as
+    calling write_csv_data_row() for each frequency, but formats a row with one string
+    operation and writes block_rows rows per call.
+    """
+    columns = csv_data_columns(frequencies, output_data, results)
+    # " {:.3e}," for the frequency then " {:>10}" for each value, with a trailing comma
+    row_format = " %.3e," + ",".join([" %10.3e"] * (len(columns) - 1) + [""]) + "\n"
+    rows = list(zip(*columns))
+    for start in range(0, len(rows), block_rows):
+        csvfile.write("".join([row_format % row for row in rows[start:start + block_rows]]))
+
+class CsvWriter:
+    """
+    Fixed-width CSV output backend: the header is written on opening and the rows of each
+    block of results by write_block(), with write_csv_data_block().
+    """
+
+    def __init__(self, output_file, output_data):
+        self.output_data = output_data
+        self.file = open(output_file, 'w')
+        write_csv_header(self.file, output_data)
+
+    def write_block(self, frequencies, results):
+        write_csv_data_block(self.file, frequencies, self.output_data, results)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_output(output_file, output_data, rows=None):
+    # Output backend chosen by the file extension; CSV unless it is .npy or .npz.
+    # rows, if known, lets .npy outputs be written block by block.
+    if output_file.endswith(BINARY_EXTENSIONS):
+        # The binary backend needs NumPy, so it is only imported when asked for
+        from binary_writer import BinaryWriter
+        return BinaryWriter(output_file, output_data, rows)
+    return CsvWriter(output_file, output_data)
+
 def write_empty_output_file(output_file):
     with open(output_file, 'w') as csvfile:
         csvfile.close()
\ No newline at end of file
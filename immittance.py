@@ -0,0 +1,24 @@
+import math
+
+def component_immittance(frequencies, n2, component_type, value):
+    """
+    Series impedance (n2 != 0) or shunt admittance (n2 == 0) of one component over the sweep.
+    frequencies and value may be plain floats or NumPy arrays that broadcast together, so the
+    scalar and the vectorised cascades share this one mapping. Frequency independent R and G
+    elements return value (or 1/value) unchanged.
+    """
+    if component_type == 'R':
+        impedance = value
+    elif component_type == 'L':
+        impedance = 2j * math.pi * frequencies * value
+    elif component_type == 'C':
+        impedance = -1j / (2 * math.pi * frequencies * value)
+    elif component_type == 'G':
+        impedance = 1 / value
+    else:
+        raise ValueError(f"Invalid component type: {component_type}")
+
+    # A shunt G keeps 1/G rather than G, as impedance_matrix() has always done
+    if n2 == 0 and component_type != 'G':
+        return 1 / impedance
+    return impedance
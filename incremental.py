@@ -0,0 +1,64 @@
+### Libraries ###
+import numpy as np
+
+### Local Modules ###
+from matrix_calculations import impedance_matrices, calculate_output_variables, component_matrices, multiply_abcd
+
+class IncrementalCascade:
+    """
+    Solver for interactive tuning of one circuit over a fixed sweep. It keeps the ABCD
+    matrices of every component together with the prefix products M[0] ... M[k-1] and
+    suffix products M[k] ... M[n-1] for every frequency, so changing the value of
+    component k needs only prefix[k] . M[k] . suffix[k+1], one (Nfreqs, 2, 2) multiply
+    pair, instead of a full re-cascade. Products that an update makes stale are
+    recomputed lazily, and only as far as the next update needs them.
+    index refers to the position of the component in the (sorted) components given.
+    """
+
+    def __init__(self, frequencies, components, vt, rs, rl, output_data):
+        self.frequencies = np.asarray(frequencies, dtype=float)
+        self.components = list(components)
+        self.vt, self.rs, self.rl, self.output_data = vt, rs, rl, output_data
+
+        n = len(self.components)
+        identity = np.broadcast_to(np.identity(2, dtype=complex), self.frequencies.shape + (2, 2))
+        self.matrices = component_matrices(self.frequencies, self.components) if n else np.empty((0,) + identity.shape, dtype=complex)
+        self.prefix = np.empty((n + 1,) + identity.shape, dtype=complex)
+        self.suffix = np.empty((n + 1,) + identity.shape, dtype=complex)
+        self.prefix[0] = identity
+        self.suffix[n] = identity
+        # prefix[0 .. prefix_valid] and suffix[suffix_valid .. n] are up to date
+        self.prefix_valid, self.suffix_valid = 0, n
+        self._extend_prefix(n)
+        self.total = self.prefix[n]
+
+    def _extend_prefix(self, k):
+        # Bring prefix[0 .. k] up to date
+        for i in range(self.prefix_valid, k):
+            self.prefix[i + 1] = multiply_abcd(self.prefix[i], self.matrices[i])
+        self.prefix_valid = max(self.prefix_valid, k)
+
+    def _extend_suffix(self, k):
+        # Bring suffix[k .. n] up to date
+        for i in range(self.suffix_valid - 1, k - 1, -1):
+            self.suffix[i] = multiply_abcd(self.matrices[i], self.suffix[i + 1])
+        self.suffix_valid = min(self.suffix_valid, k)
+
+    def update_component(self, index, value):
+        # Change the value of component index and update the total ABCD matrices
+        index = range(len(self.components))[index]
+        n1, n2, component_type, _ = self.components[index]
+        self.components[index] = (n1, n2, component_type, float(value))
+        self.matrices[index] = impedance_matrices(self.frequencies, n1, n2, component_type, value)
+
+        self._extend_prefix(index)
+        self._extend_suffix(index + 1)
+        self.total = multiply_abcd(multiply_abcd(self.prefix[index], self.matrices[index]), self.suffix[index + 1])
+
+        # Products that include the changed component are now stale
+        self.prefix_valid = min(self.prefix_valid, index)
+        self.suffix_valid = max(self.suffix_valid, index + 1)
+
+    def outputs(self):
+        # Output variables for the current component values, as calculate_output_variables() gives them
+        return calculate_output_variables(self.total, self.vt, self.rs, self.rl, self.output_data)
@@ -1,19 +1,40 @@
 ### Libraries ###
+import importlib
+import os
 import sys
-import numpy as np
 
 ### Local Modules ###
-from csv_writer import *            
-from matrix_calculations import *   
-from net_parser import *
+# Only modules that do not need NumPy are imported up front; the NumPy kernels are imported
+# by main() once it has a sweep to compute with them (see scalar_cascade for small sweeps)
+from csv_writer import write_empty_output_file, open_output, BINARY_EXTENSIONS
+from net_parser import parse_options, parse_arguments, parse_net_stream, scan_net_file, is_ladder, parse_component, parse_net_file
+from profiling import get_profiler, NULL_PROFILER
 
 # global variables and constants
 input_file, output_file = None, None
 Z_SOURCE = 50      # Assuming the source impedanceedance Rs is 50 Ohms if not specified in the file
 
-def main(input_file, output_file):
-    circuit_data, terms_data, output_data = parse_net_file(input_file)
-    
+def main(input_file, output_file, workers=None, cache=None, fold_stats=False, tolerance=None, samples=None, seed=None,
+         adaptive=None, profile=False, chunk_size=None, responses=None, terminations=None, optimize=None, tune=None):
+    # Stage timers and counters; a no-op unless profiling is switched on
+    profiler = get_profiler(profile)
+    sorted_components = components = folded = None
+    try:
+        if cache is not None:
+            # Only hash the CIRCUIT block; a warm cache then skips component parsing entirely
+            with profiler.stage('cache load'):
+                digest, terms_data, output_data = scan_net_file(input_file)
+                entry = cache.load(digest)
+            if entry is not None:
+                sorted_components, folded = entry
+        if sorted_components is None:
+            # Parse the netlist in a single streaming pass; components come back as typed arrays
+            with profiler.stage('parse'):
+                components, terms_data, output_data = parse_net_stream(input_file, output_file)
+    except ValueError as e:
+        print(e)        # If there is a format error in the components
+        sys.exit(1)     # Exit the program or handle it as needed
+
     # Handle source specs
     if 'VT' in terms_data:
         vt = terms_data['VT']
@@ -26,59 +47,226 @@ def main(input_file, output_file):
         print("Error: Source not specified correctly in terms data.")
         sys.exit(1)
     
-    # Parse and sort components
-    try:
-        parsed_components = [parse_component(line, output_file) for line in circuit_data]
-        sorted_components = sorted(parsed_components, key=lambda x: (x[0], x[1]))    
-    except ValueError as e:
-        print(e)        # If there is a format error in the components
-        sys.exit(1)     # Exit the program or handle it as needed
-    
     if 'LFstart' in terms_data and 'LFend' in terms_data:
             # Logarithmic sweep
             
             f_start = terms_data['LFstart']
             f_end = terms_data['LFend']
-            frequencies = np.logspace(np.log10(f_start), np.log10(f_end), num=terms_data['Nfreqs'])
+            # Points are computed on demand, exactly as np.logspace() would give them. Only
+            # NumPy's log10 and power give those points to the last bit, so log sweeps need NumPy.
+            import numpy as np
+            sweep = (np.log10(f_start), np.log10(f_end), terms_data['Nfreqs'], True)
     elif 'Fstart' in terms_data and 'Fend' in terms_data:
         # Linear frequency sweep
         
         f_start = terms_data.get('Fstart', 1)       # Default start frequency if not specified
         f_end = terms_data.get('Fend', 1e6)         # Default end frequency if not specified
-        frequencies = np.linspace(f_start, f_end, num=terms_data.get('Nfreqs', 10))
+        sweep = (f_start, f_end, terms_data.get('Nfreqs', 10), False)     # As np.linspace()
     else: 
         print("Error: Frequency sweep not specified correctly in terms data.")  # If frequency sweep is not specified
         write_empty_output_file(output_file) 
+        sys.exit(1)
+
+    # Small linear sweeps of ladders, written as plain CSV, are solved one frequency at a time
+    # without importing NumPy at all; the rows match the NumPy path below to rounding
+    from scalar_cascade import SCALAR_MAX_WORK, component_tuples, sweep_points, write_scalar_csv
+    plain = not (workers and workers > 1) and not (tolerance or adaptive or chunk_size or fold_stats or responses
+                                                    or terminations or optimize)
+    if (plain and components is not None and cache is None and profiler is NULL_PROFILER and not sweep[3]
+            and output_file.endswith('.csv') and sweep[2] * (len(components[0]) + len(output_data)) <= SCALAR_MAX_WORK):
+        scalar_components = component_tuples(*components)
+        if is_ladder(scalar_components):
+            try:
+                write_scalar_csv(output_file, sweep_points(*sweep[:3]), scalar_components, vt, rs,
+                                 terms_data.get('RL', Z_SOURCE), output_data)
+                return
+            except ZeroDivisionError:
+                pass    # Python raises where NumPy gives inf or nan, so leave those sweeps to NumPy
+
+    from matrix_calculations import fold_constant_runs, calculate_output_variables
+    from sweep import solve_sweep, memoized_sweep, adaptive_sweep, report_progress, FrequencySweep
+    from component_table import ComponentTable
+    frequencies = FrequencySweep(*sweep[:3], log=sweep[3])
+    if sorted_components is None:
+        # Store the components in a compact table sorted by node numbers
+        with profiler.stage('sort'):
+            sorted_components = ComponentTable.from_arrays(*components).sorted()
+
+    # The cascade kernels are only right for ladders; bridged or meshed circuits go to nodal analysis
+    ladder = is_ladder(sorted_components)
+    if cache is not None and components is not None:
+        # Ladders are cached with their R/G runs already folded, so warm runs skip the fold
+        with profiler.stage('fold'):
+            folded = fold_constant_runs(sorted_components) if ladder else None
+        with profiler.stage('cache store'):
+            cache.store(digest, sorted_components, folded)
+
+    if optimize is not None:
+        if not ladder:
+            raise ValueError("Optimisation needs a ladder circuit.")
+        # Tune the chosen component values to the response mask, then sweep the tuned circuit
+        from optimize import MaskOptimizer, read_mask
+        with profiler.stage('optimise'):
+            optimizer = MaskOptimizer(frequencies, sorted_components, read_mask(optimize), vt, rs,
+                                      terms_data.get('RL', Z_SOURCE), tune)
+            tuned = optimizer.run()
+        profiler.count('cascade evaluations', optimizer.evaluations)
+        optimizer.report(sorted_components)
+        sorted_components, folded = tuned, None
+
+    if tolerance is not None:
+        if not ladder:
+            raise ValueError("Tolerance analysis needs a ladder circuit.")
+        if terminations:
+            raise ValueError("Tolerance analysis is done for the terminations of the netlist only.")
+        # Monte Carlo tolerance analysis: write percentile bands of the outputs instead of one sweep
+        if output_file.endswith(BINARY_EXTENSIONS):
+            raise ValueError("Tolerance analysis is written as CSV only.")
+        from tolerance import write_tolerance_csv, DEFAULT_SAMPLES
+        with profiler.stage('tolerance'), open(output_file, 'w') as csvfile:
+            write_tolerance_csv(csvfile, frequencies, sorted_components, tolerance, vt, rs, terms_data.get('RL', Z_SOURCE),
+                                output_data, samples or DEFAULT_SAMPLES, seed)
+        profiler.report()
+        return
+
+    # R and G sections are the same at every frequency, so multiply each run of them out once
+    # (unless the circuit cache already had them folded)
+    with profiler.stage('fold'):
+        if not ladder:
+            from nodal import NodalNetwork
+            sections, saved = NodalNetwork(sorted_components), 0
+        else:
+            sections, saved = folded if folded is not None else fold_constant_runs(sorted_components)
+    if fold_stats:
+        print(f"Folded {len(sorted_components)} components into {len(sections)} sections: "
+              f"{saved} matrix multiplies saved per frequency, {saved * len(frequencies)} over the sweep")
            
-    # Write output data to the CSV file    
-    with open(output_file, 'w') as csvfile:
-        # Write headers and units to the CSV file
-        write_csv_header(csvfile, output_data)
-        
-        # Calculate and write data for each frequency
-        for f in frequencies:
-            abcd_matrices = []  # Initialise list to store ABCD matrices for each component
-            for n1, n2, component_type, value in sorted_components: 
-                # Calculate the impedance matrix for each component
-                matrix = impedance_matrix(f, n1, n2, component_type, value)
-                abcd_matrices.append(matrix)    
-        
-            total_matrix = cascade_matrices(abcd_matrices) # Cascade all matrices to get the total matrix
-            
-            # Calculate all output variables for this frequency
-            results = calculate_output_variables(total_matrix, vt, rs, terms_data.get('RL', Z_SOURCE), output_data) 
-            
-            # Write the data row to the CSV file
-            write_csv_data_row(csvfile, f, output_data, results)
+    terms, outputs = (vt, rs, terms_data.get('RL', Z_SOURCE)), [output_file]
+    if terminations:
+        # Every RS:RL pair gets its own output file, all evaluated from the one cascade as
+        # (K, 1) columns of terms; a Norton source keeps its current for every RS
+        import numpy as np
+        rs, rl = (np.array(column, dtype=float)[:, np.newaxis] for column in zip(*terminations))
+        terms = (terms_data['IN'] * rs if 'VT' not in terms_data else np.full_like(rs, vt), rs, rl)
+        outputs = [termination_file(output_file, *termination) for termination in terminations]
 
-if __name__ == "__main__":
+    # Write output data to the CSV file, or a binary file for .npy/.npz outputs
+    with profiler.stage('write'):
+        # Headers and units are written on opening
+        writers = [open_output(path, output_data, None if adaptive else len(frequencies)) for path in outputs]
+    counts = {}     # Work the solvers actually do, for the profiler (see count_solved())
     try:
-        # Parse command line arguments
-        input_file, output_file = parse_arguments(sys.argv[1:])
-        main(input_file, output_file)
+        # Ladder sections are cascaded with the closed-form ladder kernel, other circuits
+        # solved by nodal analysis (see solve_circuit()). With several workers
+        # the sweep is split into frequency chunks which come back in order.
+        if adaptive:
+            # Refine the sweep around fast changes of Av, up to a budget of points
+            with profiler.stage('cascade'):
+                chunks = [adaptive_sweep(frequencies, sections, terms_data.get('RL', Z_SOURCE), adaptive,
+                                         log='LFstart' in terms_data, counts=counts)]
+        elif responses is not None:
+            # Only frequencies not solved by earlier runs of the same circuit are solved now
+            from circuit_cache import circuit_digest
+            chunks = memoized_sweep(frequencies, sections, responses, circuit_digest(sorted_components), workers, chunk_size,
+                                    counts=counts)
+        else:
+            # With chunk_size, chunks are solved, written and released one at a time
+            chunks = solve_sweep(frequencies, sections, workers, chunk_size, counts=counts)
+        done = 0
+        for frequency_chunk, total_matrices in profiler.iterate('cascade', chunks):
+            # Calculate all output variables for every frequency of the chunk at once
+            with profiler.stage('outputs'):
+                results = calculate_output_variables(total_matrices, *terms, output_data)
+
+            # Write the data rows of the chunk to the output file (one per termination)
+            with profiler.stage('write'):
+                for k, writer in enumerate(writers):
+                    writer.write_block(frequency_chunk, {name: value[k] for name, value in results.items()}
+                                       if terminations else results)
+            done += len(frequency_chunk)
+            if chunk_size:
+                report_progress(done, len(frequencies))
+    finally:
+        # Binary outputs are written in one call here
+        with profiler.stage('write'):
+            for writer in writers:
+                writer.close()
+    for name, n in counts.items():
+        profiler.count(name, n)
+    if saved:
+        # Each folded run is applied as one section, at every frequency actually solved
+        profiler.count('sections saved by folding', saved * counts.get('frequencies solved', 0))
+    profiler.report()
+
+def termination_file(output_file, rs, rl):
+    # Output file of one --terminations pair: out.csv -> out_RS50_RL75.csv
+    root, extension = os.path.splitext(output_file)
+    return f"{root}_RS{rs:g}_RL{rl:g}{extension}"
+
+def __getattr__(name):
+    # Names of the NumPy modules main.py used to import with *, imported when first asked for
+    for module in ('matrix_calculations', 'csv_writer', 'net_parser'):
+        module = importlib.import_module(module)
+        if hasattr(module, name):
+            return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def run_file(input_file, output_file, **settings):
+    # Solve one netlist the way the command line does and return its exit status.
+    # settings are passed on to main().
+    try:
+        main(input_file, output_file, **settings)
+    except SystemExit as e:
+        return e.code
     except Exception as e:
         # Handle any exceptions and print error message
         print(f"Error: {e}")
         if output_file:
             write_empty_output_file(output_file)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    try:
+        # Parse command line arguments
+        arguments, options = parse_options(sys.argv[1:])
+        cache = None
+        if 'cache' in options:
+            # Reuse compiled circuits from an on-disk cache
+            from circuit_cache import CircuitCache, DEFAULT_CACHE_MB
+            cache = CircuitCache(options['cache'], options.get('cache-size', DEFAULT_CACHE_MB))
+        responses = None
+        if 'response-cache' in options or 'response-stats' in options:
+            # Remember solved frequencies, in memory and (with a file) from one run to the next
+            from circuit_cache import ResponseCache, DEFAULT_RESPONSE_MB
+            responses = ResponseCache(options.get('response-cache'), options.get('response-cache-size', DEFAULT_RESPONSE_MB))
+        # main() settings shared by --batch and single-file runs
+        settings = {'cache': cache, 'fold_stats': 'fold-stats' in options, 'tolerance': options.get('tolerance'),
+                    'samples': options.get('samples'), 'seed': options.get('seed'), 'adaptive': options.get('adaptive'),
+                    'profile': 'profile' in options, 'chunk_size': options.get('chunk-size'), 'responses': responses,
+                    'terminations': options.get('terminations'), 'optimize': options.get('optimize'),
+                    'tune': options.get('tune')}
+        if 'serve' in options:
+            # Answer JSON-lines solve requests on stdin until it is closed
+            from server import serve
+            status = serve(options.get('workers'), cache, responses)
+        elif 'batch' in options:
+            # Solve a whole directory of .net files in this process
+            if arguments:
+                raise ValueError("No input or output file may be given with --batch.")
+            if responses is not None and options.get('workers', 1) > 1:
+                raise ValueError("The response cache is only shared by batches solved in one process.")
+            from batch import run_batch
+            status = 1 if run_batch(options['batch'], options.get('out-dir'), options.get('workers'), **settings) else 0
+        else:
+            input_file, output_file = parse_arguments(arguments)
+            status = run_file(input_file, output_file, workers=options.get('workers'), **settings)
+        if responses is not None:
+            if responses.path is not None:
+                responses.save()
+            if 'response-stats' in options:
+                responses.report()
+    except ValueError as e:
+        print(f"Error: {e}")
         sys.exit(1)
+    sys.exit(status)
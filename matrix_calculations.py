@@ -1,5 +1,8 @@
 import numpy as np
 import cmath
+from component_table import ComponentTable
+from immittance import component_immittance
+from output_variables import OUTPUT_VARIABLES, evaluate_output
 
 def impedance_matrix(frequency, n1, n2, component_type, value):
     # Convert n1 and n2 to integers to handle node connections properly
@@ -40,6 +43,208 @@ def cascade_matrices(matrices):
             print("Invalid matrix skipped")
     return result
 
+def impedance_matrices(frequencies, n1, n2, component_type, value):
+    """
+    Vectorised form of impedance_matrix(): build the ABCD matrix of one component
+    for every frequency of the sweep at once, as an (Nfreqs, 2, 2) complex array.
+    value may also be an array of K sampled values, giving (K, Nfreqs, 2, 2) matrices.
+    """
+    n1, n2 = int(n1), int(n2)
+
+    frequencies = np.asarray(frequencies, dtype=float)
+    value = np.asarray(value, dtype=float)
+    # One row of matrices per sampled value
+    value = value.reshape(value.shape + (1,) * frequencies.ndim)
+    shape = np.broadcast_shapes(value.shape, frequencies.shape)
+
+    immittance = component_immittance(frequencies, n2, component_type, value)
+    matrices = np.zeros(shape + (2, 2), dtype=complex)
+    matrices[..., 0, 0] = 1
+    matrices[..., 1, 1] = 1
+    # Shunt admittance in the C position, series impedance in the B position
+    if n2 == 0:
+        matrices[..., 1, 0] = immittance
+    else:
+        matrices[..., 0, 1] = immittance
+    return matrices
+
+def cascade_matrix_stacks(matrix_stacks):
+    """
+    Cascade (Nfreqs, 2, 2) matrix stacks with a stacked matmul, one stack per component.
+    Accepts any iterable so the stacks can be generated one at a time.
+    """
+    result = None
+    for matrices in matrix_stacks:
+        result = matrices if result is None else np.matmul(result, matrices)
+    if result is None:
+        result = np.identity(2, dtype=complex)
+    return result
+
+def cascade_ladder(frequencies, components):
+    """
+    Closed-form cascade for series/shunt ladders: the four A, B, C, D vectors are
+    updated in place for each component, so no 2x2 matrices are built.
+    components may also contain the constant 2x2 matrices made by fold_constant_runs().
+    Returns the total ABCD matrices as an (Nfreqs, 2, 2) array.
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    a = np.ones(frequencies.shape, dtype=complex)
+    b = np.zeros(frequencies.shape, dtype=complex)
+    c = np.zeros(frequencies.shape, dtype=complex)
+    d = np.ones(frequencies.shape, dtype=complex)
+    scratch = np.empty(frequencies.shape, dtype=complex)
+
+    for section in components:
+        if isinstance(section, np.ndarray):
+            # Folded run of R/G sections (see fold_constant_runs()): [[a, b], [c, d]] . M
+            (m00, m01), (m10, m11) = section.tolist()
+            a, b = a * m00 + b * m10, a * m01 + b * m11
+            c, d = c * m00 + d * m10, c * m01 + d * m11
+            continue
+        n1, n2, component_type, value = section
+        immittance = component_immittance(frequencies, int(n2), component_type, float(value))
+        if int(n2) == 0:
+            # [[a, b], [c, d]] . [[1, 0], [Y, 1]] -> a += b*Y, c += d*Y
+            a += np.multiply(b, immittance, out=scratch)
+            c += np.multiply(d, immittance, out=scratch)
+        else:
+            # [[a, b], [c, d]] . [[1, Z], [0, 1]] -> b += a*Z, d += c*Z
+            b += np.multiply(a, immittance, out=scratch)
+            d += np.multiply(c, immittance, out=scratch)
+
+    return np.stack((np.stack((a, b), axis=-1), np.stack((c, d), axis=-1)), axis=-2)
+
+def fold_constant_runs(components):
+    """
+    Precompilation pass over the sorted components: each run of two or more consecutive
+    R/G sections is multiplied out once into a single constant 2x2 ABCD matrix, since
+    those sections are the same at every frequency. L, C and lone R/G components are
+    kept as they are. Returns (sections, saved) where saved is the number of matrix
+    multiplies removed per frequency.
+    """
+    sections, run, saved = [], [], 0
+    for component in list(components) + [None]:
+        if component is not None and component[2] in ('R', 'G'):
+            run.append(component)
+            continue
+        # A reactive component (or the end of the list) closes the current R/G run
+        if len(run) > 1:
+            sections.append(cascade_matrices(impedance_matrix(0, *c) for c in run))
+            saved += len(run) - 1
+        else:
+            sections.extend(run)
+        run = []
+        if component is not None:
+            sections.append(component)
+    return sections, saved
+
+def multiply_abcd(left, right):
+    """
+    Product of two broadcastable (..., 2, 2) ABCD stacks, written out element by element,
+    which is much faster than np.matmul when the matrices themselves are only 2x2.
+    """
+    a, b, c, d = left[..., 0, 0], left[..., 0, 1], left[..., 1, 0], left[..., 1, 1]
+    e, f, g, h = right[..., 0, 0], right[..., 0, 1], right[..., 1, 0], right[..., 1, 1]
+    product = np.empty(np.broadcast_shapes(left.shape, right.shape), dtype=complex)
+    product[..., 0, 0] = a * e + b * g
+    product[..., 0, 1] = a * f + b * h
+    product[..., 1, 0] = c * e + d * g
+    product[..., 1, 1] = c * f + d * h
+    return product
+
+def _rescale(matrices, exponent):
+    # Scale each 2x2 matrix by a power of two so its largest real or imaginary part is
+    # below one and keep the base-2 exponent, so long products neither overflow nor
+    # underflow. Power-of-two scaling is exact, so no precision is lost.
+    parts = np.abs(matrices.view(float))
+    largest = np.maximum(np.maximum(parts[..., 0, 0], parts[..., 0, 1]), np.maximum(parts[..., 0, 2], parts[..., 0, 3]))
+    largest = np.maximum(largest, np.maximum(np.maximum(parts[..., 1, 0], parts[..., 1, 1]),
+                                             np.maximum(parts[..., 1, 2], parts[..., 1, 3])))
+    _, shift = np.frexp(largest)
+    matrices *= np.exp2(-shift)[..., np.newaxis, np.newaxis]
+    exponent += shift
+
+def tree_reduce(matrices, exponent=None):
+    """
+    Pairwise (divide-and-conquer) product of an (Ncomp, Nfreqs, 2, 2) array in component order.
+    Returns the rescaled product (Nfreqs, 2, 2) and its base-2 exponent (Nfreqs,): product * 2**exponent.
+    """
+    matrices = np.array(matrices, dtype=complex)
+    if exponent is None:
+        exponent = np.zeros(matrices.shape[:-2])
+    while len(matrices) > 1:
+        # Multiply neighbouring pairs, carrying an odd trailing block to the next level
+        odd = len(matrices) % 2
+        products = multiply_abcd(matrices[0:-1:2] if odd else matrices[0::2], matrices[1::2])
+        exponents = (exponent[0:-1:2] if odd else exponent[0::2]) + exponent[1::2]
+        _rescale(products, exponents)
+        if odd:
+            products = np.concatenate((products, matrices[-1:]))
+            exponents = np.concatenate((exponents, exponent[-1:]))
+        matrices, exponent = products, exponents
+    return matrices[0], exponent[0]
+
+def component_matrices(frequencies, components):
+    """
+    ABCD matrices of a list of components or a ComponentTable as one
+    (Ncomp, Nfreqs, 2, 2) array, computed per component type rather than per component.
+    """
+    if isinstance(components, ComponentTable):
+        n2, types, values = components.n2, components.types, components.values[:, np.newaxis]
+    else:
+        n2 = np.array([int(c[1]) for c in components])
+        types = np.array([c[2] for c in components])
+        values = np.array([float(c[3]) for c in components])[:, np.newaxis]
+    shunt = n2 == 0
+
+    matrices = np.zeros((len(components),) + frequencies.shape + (2, 2), dtype=complex)
+    matrices[..., 0, 0] = 1
+    matrices[..., 1, 1] = 1
+    for component_type in np.unique(types):
+        for is_shunt, (row, col) in ((True, (1, 0)), (False, (0, 1))):
+            mask = (types == component_type) & (shunt == is_shunt)
+            if mask.any():
+                immittance = component_immittance(frequencies, 0 if is_shunt else 1, component_type, values[mask])
+                matrices[mask, :, row, col] = immittance
+    return matrices
+
+def _cascade_chunk(frequencies, components):
+    # Reduce one chunk of the component list to a single rescaled product
+    matrices = component_matrices(frequencies, components)
+    exponent = np.zeros(matrices.shape[:-2])
+    _rescale(matrices, exponent)
+    return tree_reduce(matrices, exponent)
+
+def cascade_tree(frequencies, components, workers=None, use_processes=False, chunk_size=256, return_exponent=False):
+    """
+    Divide-and-conquer cascade for very long ladders. The component list is split into
+    chunks which are reduced independently (optionally on a thread or process pool) and
+    the chunk products are then combined pairwise, rescaling every partial product.
+    With return_exponent the rescaled product and its base-2 exponent are returned
+    instead of the (possibly overflowing) total matrices.
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    if not isinstance(components, ComponentTable):
+        components = list(components)
+    if not len(components):
+        total = np.broadcast_to(np.identity(2, dtype=complex), frequencies.shape + (2, 2)).copy()
+        exponent = np.zeros(frequencies.shape)
+    else:
+        chunks = [components[i:i + chunk_size] for i in range(0, len(components), chunk_size)]
+        if workers and workers > 1 and len(chunks) > 1:
+            from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+            executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+            with executor(max_workers=workers) as pool:
+                partials = list(pool.map(_cascade_chunk, [frequencies] * len(chunks), chunks))
+        else:
+            partials = [_cascade_chunk(frequencies, chunk) for chunk in chunks]
+        total, exponent = tree_reduce([p[0] for p in partials], np.array([p[1] for p in partials]))
+
+    if return_exponent:
+        return total, exponent
+    with np.errstate(over='ignore', invalid='ignore'):
+        return total * np.exp2(exponent)[..., np.newaxis, np.newaxis]
+
 def to_dB(value, reference=1.0):
     """
     Convert a given value to decibels with respect to a reference value.
@@ -50,26 +255,18 @@ def to_dB(value, reference=1.0):
     return 10 * np.log10(value / reference)
 
 
-def calculate_output_variables(abcd_matrix, vt, rs, rl, output_data):
-    a, b, c, d = abcd_matrix.flatten()
-    zin = (a * rl + b) / (c * rl + d)  # Input impedances seen looking into the source
-    zout = (d * rs + b) / (c * rs + a)  # Output impedances seen looking into the load
-    
-    av = rl / ((a * rl) + b) # Voltage gain
-    ai = 1 / ((c * rl) + d)  # Current gain
-    ap = av * ai.conj() # Power gain
-    
-    vin = (vt * zin) / (zin + rs)  # Voltage input
-    iin = vt / (zin + rs) # vin / zin 
-    vout = vin * av  # Voltage output
-    iout = iin * ai  # Current output
-    pin = vin * iin.conj()  # Power input
-    pout = pin * ap  # Power output
-    
-    results = {
-        'Vin': vin, 'Vout': vout, 'Iin': iin, 'Iout': iout, 
-        'Pin': pin, 'Zin': zin, 'Pout': pout, 'Zout': zout,
-        'Av': av, 'Ai': ai,
-    }
-                
-    return results
\ No newline at end of file
+def calculate_output_variables(abcd_matrix, vt, rs, rl, output_data=None):
+    """
+    Evaluate the output variables requested in output_data (all of them if it is None) and
+    only the intermediates they need. Works for a single 2x2 matrix or an (Nfreqs, 2, 2)
+    stack of them; each result is an array with one value per frequency.
+    Variables without a formula are left out of the results.
+    vt, rs and rl may also be (K, 1) arrays of K terminations, giving (K, Nfreqs) results
+    for all of them from the one cascade.
+    """
+    abcd_matrix = np.asarray(abcd_matrix)
+    values = {'a': abcd_matrix[..., 0, 0], 'b': abcd_matrix[..., 0, 1], 'c': abcd_matrix[..., 1, 0],
+              'd': abcd_matrix[..., 1, 1], 'vt': vt, 'rs': rs, 'rl': rl}
+    names = OUTPUT_VARIABLES if output_data is None else [name for name, _ in output_data]
+    return {name: np.asarray(evaluate_output(name, values)) for name in names
+            if name in OUTPUT_VARIABLES and not name.startswith('_')}
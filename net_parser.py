@@ -1,10 +1,16 @@
 import re
+from array import array
 from csv_writer import write_empty_output_file
 
+# Compiled once at import rather than on every parse_component() call
+COMPONENT_PATTERN = re.compile(r'n1\s*=\s*(\d+)\s+n2\s*=\s*(\d+)\s+(R|L|C|G)\s*=\s*([0-9.e+-]+)')
+
+# Component type codes used by the typed component arrays are indices into this string
+COMPONENT_TYPES = 'RLCG'
+
 def parse_component(component, output_file):
     # Parse the component line and return the node numbers, component type, and value
-    pattern = r'n1\s*=\s*(\d+)\s+n2\s*=\s*(\d+)\s+(R|L|C|G)\s*=\s*([0-9.e+-]+)'
-    match = re.match(pattern, component.strip())
+    match = COMPONENT_PATTERN.match(component.strip())
     if not match:
         # If the component is not formatted correctly, write an empty output file and raise an error
         write_empty_output_file(output_file)
@@ -12,6 +18,33 @@ def parse_component(component, output_file):
     n1, n2, ctype, value = int(match.group(1)), int(match.group(2)), match.group(3), float(match.group(4))
     return n1, n2, ctype, value
 
+def parse_terms_line(line, terms_data):
+    # Split each key=value pair of a TERMS line into the terms_data dictionary
+    pairs = line.split()
+    for pair in pairs:
+        if '=' in pair:
+            key, value = pair.split('=', 1)
+            try:
+                # If the key is 'Nfreqs', we need to ensure it is stored as an integer
+                if key.strip() == 'Nfreqs':
+                    terms_data[key.strip()] = int(float(value.strip()))  # Convert to integer
+                else:
+                    terms_data[key.strip()] = float(value.strip())
+            except ValueError:
+                terms_data[key.strip()] = value.strip()
+
+def parse_output_line(line, output_data):
+    # Append the (name, unit) of an OUTPUT line to output_data
+    parts = line.split()
+
+    # If the output variable has no unit manually add 'L'
+    if len(parts) == 1:
+        output_data.append((parts[0], 'L'))
+    elif len(parts) == 2:
+        output_data.append((parts[0], parts[1]))
+    else:
+        print(f"Warning: Unexpected output format in line: {line}") # Handle unexpected output format
+
 def parse_net_file(file_path):
     # Parse the input file and return the circuit data, terms data, and output data
     with open(file_path, 'r') as file:
@@ -43,34 +76,174 @@ def parse_net_file(file_path):
         elif current_block == 'CIRCUIT' and current_block:
             circuit_data.append(line)
         elif current_block == 'TERMS' and current_block:
-            pairs = line.split()
-            for pair in pairs:
-                # Split each pair into key and value and store them in the terms_data dictionary
-                if '=' in pair:
-                    key, value = pair.split('=', 1)
-                    try:
-                        # If the key is 'Nfreqs', we need to ensure it is stored as an integer
-                        if key.strip() == 'Nfreqs':
-                            terms_data[key.strip()] = int(float(value.strip()))  # Convert to integer
-                        else:
-                            terms_data[key.strip()] = float(value.strip())
-                    except ValueError:
-                        terms_data[key.strip()] = value.strip()
-                        
-        # Adjust the output_data parsing
+            parse_terms_line(line, terms_data)
         elif current_block == 'OUTPUT' and current_block:
-            parts = line.split()
-            
-            # If the output variable has no unit manually add 'L'
-            if len(parts) == 1:
-                output_data.append((parts[0], 'L')) 
-            elif len(parts) == 2:
-                output_data.append((parts[0], parts[1]))
-            else:
-                print(f"Warning: Unexpected output format in line: {line}") # Handle unexpected output format
+            parse_output_line(line, output_data)
 
     return circuit_data, terms_data, output_data
 
+def parse_net_lines(lines, output_file=None, circuit_hash=None, parse_circuit=True):
+    """
+    Single-pass parser for netlists of any size. Components are matched as they are read
+    and stored in compact typed arrays (n1, n2, type code, value), where the type code
+    indexes COMPONENT_TYPES. Returns (components, terms_data, output_data).
+    Each CIRCUIT line is also fed to circuit_hash if one is given; with parse_circuit
+    False the component lines are only hashed, not matched.
+    """
+    n1s, n2s, codes, values = array('l'), array('l'), array('b'), array('d')
+    terms_data = {}
+    output_data = []
+    current_block = None
+    match_component = COMPONENT_PATTERN.match
+
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        # Check for block tags and set the current block
+        if '<CIRCUIT>' in line:
+            current_block = 'CIRCUIT'
+        elif '</CIRCUIT>' in line:
+            current_block = None
+        elif '<TERMS>' in line:
+            current_block = 'TERMS'
+        elif '</TERMS>' in line:
+            current_block = None
+        elif '<OUTPUT>' in line:
+            current_block = 'OUTPUT'
+        elif '</OUTPUT>' in line:
+            current_block = None
+        elif current_block == 'CIRCUIT':
+            if circuit_hash is not None:
+                circuit_hash.update(line.encode() + b'\n')
+            if not parse_circuit:
+                continue
+            match = match_component(line)
+            if not match:
+                # Same handling as parse_component(), with the line number added
+                if output_file:
+                    write_empty_output_file(output_file)
+                raise ValueError(f"Error: Component '{line}' on line {number} not formatted correctly.")
+            n1s.append(int(match.group(1)))
+            n2s.append(int(match.group(2)))
+            codes.append(COMPONENT_TYPES.index(match.group(3)))
+            values.append(float(match.group(4)))
+        elif current_block == 'TERMS':
+            parse_terms_line(line, terms_data)
+        elif current_block == 'OUTPUT':
+            parse_output_line(line, output_data)
+
+    return (n1s, n2s, codes, values), terms_data, output_data
+
+def parse_net_stream(file_path, output_file=None):
+    # Stream a .net file line by line through parse_net_lines()
+    with open(file_path, 'r') as file:
+        return parse_net_lines(file, output_file)
+
+def is_ladder(components):
+    """
+    True if the cascade kernels solve the circuit correctly: every component is either a
+    shunt element (n2 == 0) or the only series element between node k and node k + 1, and
+    the series elements chain node 1 through to the highest node.
+    """
+    series, last = [], 0
+    for n1, n2, _, _ in components:
+        n1, n2 = int(n1), int(n2)
+        if n1 <= 0 or n2 not in (0, n1 + 1):
+            return False
+        if n2:
+            series.append(n1)
+        last = max(last, n2, n1)
+    return sorted(series) == list(range(1, last))
+
+def scan_net_file(file_path):
+    # Hash the CIRCUIT block and parse only TERMS and OUTPUT, skipping component parsing.
+    # Returns (circuit_digest, terms_data, output_data).
+    import hashlib      # Only needed with a circuit cache, so kept out of the command-line start-up
+    circuit_hash = hashlib.sha256()
+    with open(file_path, 'r') as file:
+        _, terms_data, output_data = parse_net_lines(file, circuit_hash=circuit_hash, parse_circuit=False)
+    return circuit_hash.hexdigest(), terms_data, output_data
+
+def parse_tolerances(spec):
+    # Parse a tolerance spec such as 'R=5,C=10' into {'R': 0.05, 'C': 0.1} (percent per component type)
+    tolerances = {}
+    for item in spec.split(','):
+        ctype, _, percent = item.partition('=')
+        ctype = ctype.strip()
+        if ctype not in COMPONENT_TYPES:
+            raise ValueError(f"Invalid component type in tolerance spec: {item}")
+        tolerance = float(percent) / 100
+        if not 0 <= tolerance < 1:
+            raise ValueError(f"Tolerance must be between 0 and 100 percent: {item}")
+        tolerances[ctype] = tolerance
+    return tolerances
+
+def parse_component_types(spec):
+    # Parse a list of component types such as 'L,C' into ['L', 'C']
+    types = [ctype.strip() for ctype in spec.split(',')]
+    for ctype in types:
+        if ctype not in COMPONENT_TYPES:
+            raise ValueError(f"Invalid component type: {ctype}")
+    return types
+
+def parse_terminations(spec):
+    # Parse a termination spec such as '50:50,75:75' into [(50.0, 50.0), (75.0, 75.0)] (RS:RL pairs in Ohms)
+    terminations = []
+    for item in spec.split(','):
+        rs, _, rl = item.partition(':')
+        termination = (float(rs), float(rl))
+        if min(termination) <= 0:
+            raise ValueError(f"Terminations must be positive: {item}")
+        terminations.append(termination)
+    return terminations
+
+# Command line options: name -> converter for its value (None for a flag without a value)
+OPTIONS = {
+    'workers': int,
+    'batch': str,
+    'out-dir': str,
+    'cache': str,
+    'cache-size': float,
+    'fold-stats': None,
+    'tolerance': parse_tolerances,
+    'samples': int,
+    'seed': int,
+    'adaptive': int,
+    'profile': None,
+    'chunk-size': int,
+    'serve': None,
+    'response-cache': str,
+    'response-cache-size': float,
+    'response-stats': None,
+    'terminations': parse_terminations,
+    'optimize': str,
+    'tune': parse_component_types,
+}
+
+def parse_options(args):
+    # Split '--name value' options from the positional arguments
+    positional, options = [], {}
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if not arg.startswith('--'):
+            positional.append(arg)
+            continue
+        name = arg[2:]
+        if name not in OPTIONS:
+            raise ValueError(f"Unknown option: {arg}")
+        if OPTIONS[name] is None:
+            options[name] = True
+            continue
+        if not args:
+            raise ValueError(f"Option {arg} requires a value.")
+        try:
+            options[name] = OPTIONS[name](args.pop(0))
+        except ValueError:
+            raise ValueError(f"Invalid value for option {arg}.")
+    return positional, options
+
 def parse_arguments(args):
     # Parse the command line arguments and return the input and output file paths
     if len(args) != 2:
@@ -79,6 +252,6 @@ def parse_arguments(args):
     input_file, output_file = args
     if not input_file.endswith('.net'):
         raise ValueError("Input file must be a .net file.") 
-    if not output_file.endswith('.csv'):
-        raise ValueError("Output file must be a .csv file.")
+    if not output_file.endswith(('.csv', '.npy', '.npz')):
+        raise ValueError("Output file must be a .csv, .npy or .npz file.")
     return input_file, output_file
\ No newline at end of file
@@ -0,0 +1,91 @@
+### Libraries ###
+import numpy as np
+
+### Local Modules ###
+from immittance import component_immittance
+from net_parser import is_ladder
+
+# Largest number of matrix entries stamped and solved at once (frequencies x size**2): 16 MB
+# of complex entries, so a block and the copies np.linalg.solve() makes stay well under 128 MB
+BLOCK_ENTRIES = 2**20
+
+class NodalNetwork:
+    """
+    Modified nodal analysis of a general (bridged or meshed) network of the parsed
+    components, as a two-port from the lowest numbered node (port 1) to the highest
+    numbered node (port 2), both against the common node 0.
+
+    The stamp pattern of the admittance matrix is worked out once, when the network is
+    built; for each block of frequencies only the admittance values are stamped and the
+    systems solved. Port 2 is driven with its voltage V2 and load current I2 and port 1 is
+    left free, so V1 and I1 come out as A V2 + B I2 and C V2 + D I2: one factorisation per
+    frequency with the right-hand sides V2 = 1, I2 = 0 (giving A and C) and V2 = 0, I2 = 1
+    (giving B and D). Element values follow impedance_matrix() through component_immittance().
+    """
+
+    def __init__(self, components):
+        self.components = list(components)
+        n1 = np.array([int(c[0]) for c in self.components], dtype=int)
+        n2 = np.array([int(c[1]) for c in self.components], dtype=int)
+        nodes = np.unique(np.concatenate((n1, n2)))
+        nodes = nodes[nodes != 0]
+        if len(nodes) < 2:
+            raise ValueError("Nodal analysis needs distinct input and output nodes.")
+
+        # Unknowns: node voltages, then the current I1 flowing into port 1
+        self.size = len(nodes) + 1
+        self.input, self.output = 0, len(nodes) - 1
+        self.current = self.size - 1
+        a = np.searchsorted(nodes, n1)
+        b = np.searchsorted(nodes, n2)
+        grounded_a, grounded_b = n1 == 0, n2 == 0
+
+        # Symbolic step: flat matrix positions and signs of the four stamps of every element
+        positions, signs, elements = [], [], []
+        for row, col, sign, keep in [(a, a, 1, ~grounded_a), (b, b, 1, ~grounded_b),
+                                     (a, b, -1, ~grounded_a & ~grounded_b), (b, a, -1, ~grounded_a & ~grounded_b)]:
+            positions.append(row[keep] * self.size + col[keep])
+            signs.append(np.full(keep.sum(), sign))
+            elements.append(np.flatnonzero(keep))
+        self.positions = np.concatenate(positions)
+        self.signs = np.concatenate(signs)
+        self.elements = np.concatenate(elements)
+        self.shunt = grounded_a | grounded_b
+
+    def __len__(self):
+        return len(self.components)
+
+    def admittances(self, frequencies):
+        # Admittance of every element over the sweep as an (Ncomp, Nfreqs) array
+        result = np.empty((len(self.components),) + frequencies.shape, dtype=complex)
+        for i, ((_, _, component_type, value), shunt) in enumerate(zip(self.components, self.shunt)):
+            immittance = component_immittance(frequencies, 0 if shunt else 1, component_type, float(value))
+            # component_immittance() gives the admittance of shunt and the impedance of series elements
+            result[i] = immittance if shunt else 1 / immittance
+        return result
+
+    def _solve_block(self, frequencies):
+        m = self.size
+        matrices = np.zeros((len(frequencies), m * m), dtype=complex)
+        values = self.signs[:, np.newaxis] * self.admittances(frequencies)[self.elements]
+        np.add.at(matrices, (slice(None), self.positions), values.T)
+        matrices = matrices.reshape(len(frequencies), m, m)
+
+        # I1 flows into the input node; the last row sets V(output) = V2
+        matrices[:, self.input, self.current] = -1
+        matrices[:, self.current, self.output] = 1
+
+        # Column 0: V2 = 1, I2 = 0. Column 1: V2 = 0, I2 = 1, leaving the output node.
+        rhs = np.zeros((m, 2), dtype=complex)
+        rhs[self.current, 0] = 1
+        rhs[self.output, 1] = -1
+        x = np.linalg.solve(matrices, np.broadcast_to(rhs, matrices.shape[:-1] + (2,)))
+        # Rows V1 and I1 of the solutions are [[A, B], [C, D]]
+        return x[:, [self.input, self.current], :]
+
+    def abcd(self, frequencies):
+        # Two-port ABCD matrices over the sweep as an (Nfreqs, 2, 2) array, solved in blocks
+        frequencies = np.asarray(frequencies, dtype=float)
+        block = max(1, BLOCK_ENTRIES // self.size**2)
+        return np.concatenate([self._solve_block(frequencies[i:i + block])
+                               for i in range(0, len(frequencies), block)] or [np.empty((0, 2, 2), dtype=complex)])
@@ -0,0 +1,211 @@
+### Libraries ###
+import math
+import operator
+import numpy as np
+
+### Local Modules ###
+from matrix_calculations import OUTPUT_VARIABLES, component_matrices, multiply_abcd, evaluate_output
+from component_table import ComponentTable
+
+DEFAULT_ITERATIONS = 100
+
+def read_mask(mask_file):
+    """
+    Read a response mask: one limit per line as 'name fstart fend lower upper', where name
+    is an output variable and lower and upper bound 20 log10|name| in dB between fstart
+    and fend (inclusive). A '-' leaves that side unbounded; '#' starts a comment.
+    Returns a list of (name, fstart, fend, lower, upper) tuples.
+    """
+    mask = []
+    with open(mask_file, 'r') as file:
+        for line in file:
+            fields = line.split('#')[0].split()
+            if not fields:
+                continue
+            if len(fields) != 5 or fields[0] not in OUTPUT_VARIABLES or fields[0].startswith('_'):
+                raise ValueError(f"Invalid mask line: {line.strip()}")
+            name, fstart, fend, lower, upper = fields
+            try:
+                limit = (float(fstart), float(fend), -math.inf if lower == '-' else float(lower),
+                         math.inf if upper == '-' else float(upper))
+            except ValueError:
+                raise ValueError(f"Invalid mask line: {line.strip()}")
+            if limit[0] > limit[1] or limit[2] > limit[3]:
+                raise ValueError(f"Invalid mask line: {line.strip()}")
+            mask.append((name,) + limit)
+    if not mask:
+        raise ValueError(f"No limits in mask file {mask_file}.")
+    return mask
+
+class _Dual:
+    # A complex quantity over the sweep together with its derivatives, one row per tuned
+    # component, so the derivatives of a, b, c, d can be pushed through the OUTPUT_VARIABLES
+    # formulas. The tuned values are real, so d(conj(u)) is conj(du) even where u is not analytic.
+
+    def __init__(self, value, tangent=0):
+        self.value, self.tangent = value, tangent
+
+    def __add__(self, other):
+        other = _lift(other)
+        return _Dual(self.value + other.value, self.tangent + other.tangent)
+
+    def __sub__(self, other):
+        other = _lift(other)
+        return _Dual(self.value - other.value, self.tangent - other.tangent)
+
+    def __mul__(self, other):
+        other = _lift(other)
+        return _Dual(self.value * other.value, self.tangent * other.value + self.value * other.tangent)
+
+    def __truediv__(self, other):
+        other = _lift(other)
+        quotient = self.value / other.value
+        return _Dual(quotient, (self.tangent - quotient * other.tangent) / other.value)
+
+    def __neg__(self):
+        return _Dual(-self.value, -self.tangent)
+
+    def conjugate(self):
+        return _Dual(np.conj(self.value), np.conj(self.tangent))
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+
+    def __rsub__(self, other):
+        return _lift(other) - self
+
+    def __rtruediv__(self, other):
+        return _lift(other) / self
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        # NumPy scalars and np.conj() in the formulas come here instead of to the operators
+        if method != '__call__' or kwargs or ufunc not in _UFUNCS:
+            return NotImplemented
+        return _UFUNCS[ufunc](*[_lift(x) for x in inputs])
+
+_UFUNCS = {np.add: operator.add, np.subtract: operator.sub, np.multiply: operator.mul,
+           np.true_divide: operator.truediv, np.negative: operator.neg, np.conjugate: _Dual.conjugate}
+
+def _lift(x):
+    return x if isinstance(x, _Dual) else _Dual(x)
+
+class MaskOptimizer:
+    """
+    Tune the values of chosen components of a ladder until its response meets a mask (see
+    read_mask()), by Levenberg-Marquardt least squares on the dB violations of the limits,
+    over the log of the values so that they stay positive.
+
+    The derivatives are analytic: with the prefix products P[k] = M[0] ... M[k-1] and suffix
+    products S[k] = M[k] ... M[n-1], the derivative of the total ABCD matrix with respect to
+    component k is P[k] . dM[k] . S[k+1], and dM[k] has a single non-zero entry, so every
+    component costs one outer product per frequency. One cascade evaluation thus gives the
+    residuals and the full Jacobian, where finite differences would re-cascade the sweep
+    once per tuned component.
+    """
+
+    def __init__(self, frequencies, components, mask, vt, rs, rl, tune=None):
+        self.frequencies = np.asarray(frequencies, dtype=float)
+        self.components = ComponentTable.from_tuples(components)
+        self.mask = mask
+        self.vt, self.rs, self.rl = vt, rs, rl
+        types = self.components.types
+        self.tuned = np.flatnonzero(np.isin(types, list(tune)) if tune else np.ones(len(types), dtype=bool))
+        if not len(self.tuned):
+            raise ValueError("No components to tune.")
+
+        # Series entries sit at (0, 1) and shunt entries at (1, 0) of each M[k]; every entry
+        # is proportional to value ** power, so its derivative by log(value) is power * entry
+        shunt = self.components.shunt[self.tuned]
+        admittance = shunt & (types[self.tuned] != 'G')
+        self.shunt = shunt
+        self.power = np.where(np.isin(types[self.tuned], ['R', 'L']), 1, -1) * np.where(admittance, -1, 1)
+
+        self.limits = []
+        for name, fstart, fend, lower, upper in mask:
+            points = (self.frequencies >= fstart) & (self.frequencies <= fend)
+            if not points.any():
+                raise ValueError(f"No sweep frequencies between {fstart:g} and {fend:g} Hz for the {name} limit.")
+            self.limits.append((name, points, lower, upper))
+        self.iterations = self.evaluations = 0
+
+    def evaluate(self, log_values):
+        """
+        Cascade the circuit with the tuned values exp(log_values) and return the residuals of
+        the mask (dB outside each limit, 0 inside) and their Jacobian by log_values.
+        """
+        self.evaluations += 1
+        self.components.values[self.tuned] = np.exp(log_values)
+        matrices = component_matrices(self.frequencies, self.components)
+        n = len(matrices)
+        identity = np.broadcast_to(np.identity(2, dtype=complex), self.frequencies.shape + (2, 2))
+        prefix, suffix = [identity], [identity]
+        for i in range(n):
+            prefix.append(multiply_abcd(prefix[-1], matrices[i]))
+            suffix.append(multiply_abcd(matrices[n - 1 - i], suffix[-1]))
+        suffix.reverse()
+
+        # d(total)/d(log value) of every tuned component as a (Ntuned, Nfreqs, 2, 2) array
+        derivatives = np.empty((len(self.tuned),) + prefix[n].shape, dtype=complex)
+        for j, (k, shunt, power) in enumerate(zip(self.tuned, self.shunt, self.power)):
+            row, col = (1, 0) if shunt else (0, 1)
+            entry = power * matrices[k, :, row, col]
+            derivatives[j] = (prefix[k][:, :, row, np.newaxis] * suffix[k + 1][:, np.newaxis, col, :]) * entry[:, np.newaxis, np.newaxis]
+
+        total = prefix[n]
+        values = {'vt': self.vt, 'rs': self.rs, 'rl': self.rl}
+        for name, (i, j) in zip('abcd', [(0, 0), (0, 1), (1, 0), (1, 1)]):
+            values[name] = _Dual(total[:, i, j], derivatives[:, :, i, j])
+
+        residuals, jacobian = [], []
+        for name, points, lower, upper in self.limits:
+            output = evaluate_output(name, values)
+            value, tangent = np.broadcast_to(output.value, self.frequencies.shape), output.tangent
+            with np.errstate(divide='ignore', invalid='ignore'):
+                level = 20 * np.log10(np.abs(value[points]))
+                slope = 20 / np.log(10) * np.real(tangent[:, points] / value[points])
+            above, below = level > upper, level < lower
+            residuals.append(np.where(above, level - upper, np.where(below, lower - level, 0)))
+            jacobian.append((np.where(above, slope, np.where(below, -slope, 0))).T)
+        return np.concatenate(residuals), np.concatenate(jacobian)
+
+    def run(self, max_iterations=DEFAULT_ITERATIONS):
+        """
+        Optimise the tuned values, stopping once the mask is met, no step improves the
+        violation any more or after max_iterations. Returns the tuned ComponentTable.
+        """
+        log_values = np.log(self.components.values[self.tuned])
+        residuals, jacobian = self.evaluate(log_values)
+        self.initial_violation = self.violation = residuals @ residuals
+        damping = 1e-3
+        while self.violation > 0 and self.iterations < max_iterations:
+            self.iterations += 1
+            normal = jacobian.T @ jacobian
+            gradient = jacobian.T @ residuals
+            scale = np.diag(normal) + 1e-12 * np.trace(normal)
+            improved = False
+            while damping < 1e12:
+                step = np.linalg.solve(normal + damping * np.diag(scale), -gradient)
+                # At most a factor e per value and step, so a bad linearisation cannot run away
+                step /= max(1.0, np.abs(step).max())
+                trial_residuals, trial_jacobian = self.evaluate(log_values + step)
+                trial = trial_residuals @ trial_residuals
+                if trial < self.violation:
+                    improved = self.violation - trial > 1e-12 * self.violation
+                    log_values, residuals, jacobian = log_values + step, trial_residuals, trial_jacobian
+                    self.violation = trial
+                    damping = max(damping / 3, 1e-12)
+                    break
+                damping *= 4
+            if not improved:
+                break
+        self.components.values[self.tuned] = np.exp(log_values)
+        return self.components
+
+    def report(self, original):
+        # Print the iterations, cascade evaluations and the tuned values as CIRCUIT lines
+        print(f"Optimised {len(self.tuned)} component values in {self.iterations} iterations and "
+              f"{self.evaluations} cascade evaluations; mask violation {self.initial_violation:.3e} -> "
+              f"{self.violation:.3e} dB^2" + ("" if self.violation else " (mask met)"))
+        for k in self.tuned:
+            n1, n2, component_type, value = self.components[k]
+            print(f"n1={n1} n2={n2} {component_type}={value:.4e}    # was {original[k][3]:.4e}")
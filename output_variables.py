@@ -0,0 +1,37 @@
+# Output variables and the intermediates they need: name -> (dependencies, formula).
+# a, b, c, d are the ABCD parameters and vt, rs, rl the source and load terms. S-parameters
+# are referenced to RS at port 1 and RL at port 2; RetLoss and InsLoss are 1/S11 and 1/S21,
+# so requested in dB they give the return loss and insertion loss. Names starting with _ are
+# intermediates only and never returned. The formulas use only arithmetic and .conjugate(), so
+# they work on NumPy arrays, the optimizer's dual numbers and plain complex numbers alike.
+OUTPUT_VARIABLES = {
+    'Zin': (('a', 'b', 'c', 'd', 'rl'), lambda a, b, c, d, rl: (a * rl + b) / (c * rl + d)),   # Input impedance seen looking into the source
+    'Zout': (('a', 'b', 'c', 'd', 'rs'), lambda a, b, c, d, rs: (d * rs + b) / (c * rs + a)),  # Output impedance seen looking into the load
+    'Av': (('a', 'b', 'rl'), lambda a, b, rl: rl / ((a * rl) + b)),     # Voltage gain
+    'Ai': (('c', 'd', 'rl'), lambda c, d, rl: 1 / ((c * rl) + d)),      # Current gain
+    'Ap': (('Av', 'Ai'), lambda av, ai: av * ai.conjugate()),              # Power gain
+    'Vin': (('vt', 'rs', 'Zin'), lambda vt, rs, zin: (vt * zin) / (zin + rs)),
+    'Iin': (('vt', 'rs', 'Zin'), lambda vt, rs, zin: vt / (zin + rs)),  # vin / zin
+    'Vout': (('Vin', 'Av'), lambda vin, av: vin * av),
+    'Iout': (('Iin', 'Ai'), lambda iin, ai: iin * ai),
+    'Pin': (('Vin', 'Iin'), lambda vin, iin: vin * iin.conjugate()),
+    'Pout': (('Pin', 'Ap'), lambda pin, ap: pin * ap),
+    '_s_den': (('a', 'b', 'c', 'd', 'rs', 'rl'), lambda a, b, c, d, rs, rl: a * rl + b + c * rs * rl + d * rs),
+    'S11': (('a', 'b', 'c', 'd', 'rs', 'rl', '_s_den'), lambda a, b, c, d, rs, rl, den: (a * rl + b - c * rs * rl - d * rs) / den),
+    'S12': (('a', 'b', 'c', 'd', 'rs', 'rl', '_s_den'), lambda a, b, c, d, rs, rl, den: 2 * (a * d - b * c) * (rs * rl) ** 0.5 / den),
+    'S21': (('rs', 'rl', '_s_den'), lambda rs, rl, den: 2 * (rs * rl) ** 0.5 / den),
+    'S22': (('a', 'b', 'c', 'd', 'rs', 'rl', '_s_den'), lambda a, b, c, d, rs, rl, den: (-a * rl + b - c * rs * rl + d * rs) / den),
+    'RetLoss': (('S11',), lambda s11: 1 / s11),
+    'InsLoss': (('S21',), lambda s21: 1 / s21),
+}
+
+def evaluate_output(name, values):
+    """
+    Value of one OUTPUT_VARIABLES entry from values, a dict holding at least a, b, c, d,
+    vt, rs and rl. Only the intermediates name depends on are evaluated, and they are
+    kept in values for the next call.
+    """
+    if name not in values:
+        dependencies, formula = OUTPUT_VARIABLES[name]
+        values[name] = formula(*[evaluate_output(dependency, values) for dependency in dependencies])
+    return values[name]
@@ -0,0 +1,93 @@
+### Libraries ###
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+# Set CASCADE_PROFILE=1 to profile every run without the --profile option
+PROFILE_ENV = 'CASCADE_PROFILE'
+
+# Marks the end of an iterator in StageProfiler.iterate()
+_END = object()
+
+class StageProfiler:
+    """
+    Per-run instrumentation of the stages of main(): wall time (perf_counter), peak memory
+    allocated during the stage (tracemalloc, which also sees NumPy arrays) and the number
+    of times it ran, plus named counters. A stage entered several times, such as the
+    cascade of each frequency chunk, accumulates its time and keeps the largest peak.
+    Stages must not be nested.
+    """
+
+    def __init__(self):
+        self.stages = {}    # name -> [seconds, peak bytes, calls], in the order first run
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        # Tracing is only switched on inside a stage, so nothing is left running on errors.
+        # tracemalloc is imported here, when profiling, to keep it out of plain runs' start-up.
+        import tracemalloc
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1] - base
+            if started:
+                tracemalloc.stop()
+            entry = self.stages.setdefault(name, [0.0, 0, 0])
+            entry[0] += seconds
+            entry[1] = max(entry[1], peak)
+            entry[2] += 1
+
+    def iterate(self, name, iterable):
+        # Yield the items of iterable, timing the work of producing each one as stage name
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, _END)
+            if item is _END:
+                return
+            yield item
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        # Print the time and peak memory of every stage, then the counters
+        print("{:<16}{:>12}{:>12}{:>8}".format("Stage", "Time (s)", "Peak (MB)", "Calls"))
+        for name, (seconds, peak, calls) in self.stages.items():
+            print("{:<16}{:>12.5f}{:>12.3f}{:>8}".format(name, seconds, peak / 2**20, calls))
+        print("{:<16}{:>12.5f}".format("total", sum(entry[0] for entry in self.stages.values())))
+        for name, n in self.counters.items():
+            print(f"{name}: {n}")
+
+class NullProfiler:
+    # Stand-in used when profiling is off: every hook does (almost) nothing
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def iterate(self, name, iterable):
+        return iterable
+
+    def count(self, name, n=1):
+        pass
+
+    def report(self):
+        pass
+
+_NULL_STAGE = nullcontext()
+NULL_PROFILER = NullProfiler()
+
+def get_profiler(enabled=False):
+    # A StageProfiler if profiling is requested by the caller or the environment
+    if enabled or os.environ.get(PROFILE_ENV, '') not in ('', '0'):
+        return StageProfiler()
+    return NULL_PROFILER
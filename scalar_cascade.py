@@ -0,0 +1,55 @@
+### Local Modules ###
+from csv_writer import write_csv_header, write_csv_data_row
+from immittance import component_immittance
+from net_parser import COMPONENT_TYPES
+from output_variables import OUTPUT_VARIABLES, evaluate_output
+
+# Largest sweep, in frequencies x (components + outputs), solved without NumPy. Importing
+# NumPy costs about as much as solving this many terms one frequency at a time.
+SCALAR_MAX_WORK = 40000
+
+def component_tuples(n1s, n2s, codes, values):
+    # The parsed component arrays as (n1, n2, ctype, value) tuples, in ComponentTable.sorted() order
+    types = [COMPONENT_TYPES[code] for code in codes]
+    return sorted(zip(n1s, n2s, types, values), key=lambda component: (component[0], component[1]))
+
+def sweep_points(start, stop, num):
+    # The points of a linear FrequencySweep(start, stop, num), computed as np.linspace does
+    delta, div = stop - start, num - 1
+    if div > 0:
+        step = delta / div
+        points = [i / div * delta if step == 0 else i * step for i in range(num)]
+    else:
+        points = [i * delta for i in range(num)]
+    points = [y + start for y in points]
+    if num > 1:
+        points[-1] = stop
+    return points
+
+def cascade(frequency, components):
+    # cascade_ladder() for one frequency; returns the total (a, b, c, d)
+    a, b, c, d = 1 + 0j, 0j, 0j, 1 + 0j
+    for _, n2, component_type, value in components:
+        element = component_immittance(frequency, n2, component_type, value)
+        if n2 == 0:
+            a += b * element
+            c += d * element
+        else:
+            b += a * element
+            d += c * element
+    return a, b, c, d
+
+def write_scalar_csv(output_file, frequencies, components, vt, rs, rl, output_data):
+    """
+    Solve a ladder one frequency at a time in plain Python and write the CSV output, for
+    sweeps too small to be worth importing NumPy. The elements and outputs come from the same
+    component_immittance() and OUTPUT_VARIABLES as the NumPy path, so the rows agree with it
+    to rounding; Python's complex arithmetic is not NumPy's to the last bit. Raises
+    ZeroDivisionError where NumPy would give inf or nan.
+    """
+    names = [name for name, _ in output_data if name in OUTPUT_VARIABLES and not name.startswith('_')]
+    with open(output_file, 'w') as csvfile:
+        write_csv_header(csvfile, output_data)
+        for frequency in frequencies:
+            values = dict(zip('abcd', cascade(frequency, components)), vt=vt, rs=rs, rl=rl)
+            write_csv_data_row(csvfile, frequency, output_data, {name: evaluate_output(name, values) for name in names})
@@ -0,0 +1,130 @@
+### Libraries ###
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+### Local Modules ###
+from main import run_file
+from circuit_cache import MemoryCircuitCache, ResponseCache
+from profiling import get_profiler, NULL_PROFILER
+
+DEFAULT_THREADS = 4
+# main() settings a request may pass in its "options". Not 'profile': its peak memory comes
+# from tracemalloc, which is process-wide, so concurrent requests would spoil each other's
+# figures (and stop each other's tracing).
+REQUEST_OPTIONS = ('adaptive', 'chunk_size', 'fold_stats', 'tolerance', 'samples', 'seed')
+
+class _ThreadOutput(io.TextIOBase):
+    # Stands in for sys.stdout while serving: what a request prints goes to that request's
+    # buffer, so the messages of concurrent requests never mix with each other or with the
+    # responses. Output from any other thread goes to stderr.
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        return (buffer or sys.stderr).write(text)
+
+class SolveServer:
+    """
+    Long-running solve service. Each request is solved by run_file() in a thread pool, with
+    NumPy already imported and parsed circuits kept in a MemoryCircuitCache, so repeated
+    circuits skip component parsing, and solved frequencies kept in a ResponseCache, so
+    overlapping sweeps of a circuit only solve what is new. See handle() for the request format.
+    """
+
+    def __init__(self, threads=DEFAULT_THREADS, cache=None, responses=None):
+        # With CASCADE_PROFILE set every run is profiled, so requests are solved one at a time
+        self.threads = 1 if get_profiler() is not NULL_PROFILER else threads
+        self.cache = cache if cache is not None else MemoryCircuitCache()
+        self.responses = responses if responses is not None else ResponseCache()
+        self.output = _ThreadOutput()
+        self.scratch = tempfile.mkdtemp(prefix='cascade-server-')
+
+    def handle(self, request):
+        """
+        Solve one request and return its response. A request gives either the path of a
+        .net file ("path") or its text ("net"), optionally an "output" file to write
+        (.csv, .npy or .npz) and main() "options". Without an output the results are
+        returned as {"headers", "units", "data"}, one row per frequency. Every response
+        echoes the request "id" and holds the exit "status", the "messages" main() printed
+        and the solve "seconds".
+        """
+        response = {'id': request.get('id') if isinstance(request, dict) else None}
+        files = []
+        self.output.local.buffer = messages = io.StringIO()
+        t0 = time.perf_counter()
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("A request must be a JSON object.")
+            settings = request.get('options', {})
+            unknown = set(settings) - set(REQUEST_OPTIONS)
+            if unknown:
+                raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+            if 'tolerance' in settings:
+                settings = dict(settings, tolerance={k: v / 100 for k, v in settings['tolerance'].items()})
+
+            input_file = request.get('path')
+            if input_file is None:
+                # Netlist text is solved from a scratch file
+                handle, input_file = tempfile.mkstemp(suffix='.net', dir=self.scratch)
+                files.append(input_file)
+                with os.fdopen(handle, 'w') as file:
+                    file.write(request['net'])
+            output_file = request.get('output')
+            if output_file is None:
+                handle, output_file = tempfile.mkstemp(suffix='.npz', dir=self.scratch)
+                os.close(handle)
+                files.append(output_file)
+
+            response['status'] = run_file(input_file, output_file, cache=self.cache, responses=self.responses, **settings)
+            if request.get('output') is None and response['status'] == 0:
+                with np.load(output_file) as results:
+                    response['results'] = {'headers': results['headers'].tolist(), 'units': results['units'].tolist(),
+                                           'data': results['data'].tolist()}
+        except Exception as e:
+            response['status'] = 1
+            print(f"Error: {e}")
+        finally:
+            self.output.local.buffer = None
+            for path in files:
+                os.remove(path)
+        response['messages'] = messages.getvalue()
+        response['seconds'] = time.perf_counter() - t0
+        return response
+
+    def serve(self, requests, responses):
+        # Answer JSON-lines requests from requests with JSON-lines responses on responses, in
+        # completion order, until requests is exhausted
+        lock = threading.Lock()
+
+        def answer(line):
+            try:
+                response = self.handle(json.loads(line))
+            except ValueError as e:
+                response = {'id': None, 'status': 1, 'messages': f"Error: invalid request: {e}\n"}
+            with lock:
+                responses.write(json.dumps(response) + "\n")
+                responses.flush()
+
+        stdout = sys.stdout
+        sys.stdout = self.output
+        try:
+            with ThreadPoolExecutor(max_workers=self.threads) as pool:
+                for line in requests:
+                    if line.strip():
+                        pool.submit(answer, line)
+        finally:
+            sys.stdout = stdout
+            os.rmdir(self.scratch)
+
+def serve(threads=None, cache=None, responses=None):
+    # python main.py --serve [--workers N]: JSON-lines requests on stdin, responses on stdout
+    SolveServer(threads or DEFAULT_THREADS, cache, responses).serve(sys.stdin, sys.stdout)
@@ -0,0 +1,208 @@
+### Libraries ###
+import sys
+from collections import deque
+import numpy as np
+
+### Local Modules ###
+from matrix_calculations import cascade_ladder, calculate_output_variables
+
+# Components of the circuit being solved, set once per worker process by _init_worker()
+_worker_components = None
+
+def _init_worker(components):
+    # Pool initializer: each worker receives the parsed components once
+    global _worker_components
+    _worker_components = components
+
+def solve_circuit(frequencies, circuit):
+    # ABCD matrices of a ladder's sections (cascaded) or of a NodalNetwork (solved). A
+    # NodalNetwork is told apart by its abcd() method, so nodal is only imported by the runs
+    # that build one.
+    if hasattr(circuit, 'abcd'):
+        return circuit.abcd(frequencies)
+    return cascade_ladder(frequencies, circuit)
+
+def count_solved(counts, frequencies, circuit):
+    # Add the work of solving circuit at frequencies to the counts dict (if there is one):
+    # frequencies solved, and the ladder sections applied or the nodal systems solved
+    if counts is None:
+        return
+    n = len(frequencies)
+    if hasattr(circuit, 'abcd'):
+        work = {'frequencies solved': n, 'nodal systems solved': n}     # One factorisation, two right-hand sides
+    else:
+        work = {'frequencies solved': n, 'ladder sections applied': len(circuit) * n}
+    for name, value in work.items():
+        counts[name] = counts.get(name, 0) + value
+
+def _solve_chunk(frequencies):
+    # Solve the worker's circuit over one chunk of the sweep
+    return solve_circuit(frequencies, _worker_components)
+
+class FrequencySweep:
+    """
+    Linear sweep (np.linspace) or logarithmic sweep (np.logspace over log10 of the limits)
+    whose points are computed on demand, chunk by chunk, exactly as NumPy computes them,
+    so a sweep of 10**8 points never has to be held in memory at once. np.asarray() of a
+    sweep gives the full vector.
+    """
+
+    def __init__(self, start, stop, num, log=False):
+        self.start, self.stop, self.num, self.log = float(start), float(stop), int(num), log
+
+    def points(self, first, last):
+        # Points first .. last-1 of the sweep
+        y = np.arange(first, last, dtype=float)
+        delta, div = self.stop - self.start, self.num - 1
+        if div > 0:
+            step = delta / div
+            y = y / div * delta if step == 0 else y * step
+        else:
+            y = y * delta
+        y += self.start
+        if self.num > 1 and last == self.num:
+            y[-1] = self.stop
+        return np.power(10.0, y) if self.log else y
+
+    def chunks(self, chunk_size):
+        for first in range(0, self.num, chunk_size):
+            yield self.points(first, min(first + chunk_size, self.num))
+
+    def __len__(self):
+        return self.num
+
+    def __array__(self, dtype=None, copy=None):
+        return self.points(0, self.num).astype(dtype or float, copy=False)
+
+def frequency_chunks(frequencies, chunk_size):
+    # Consecutive chunks of at most chunk_size frequencies of a FrequencySweep or array
+    if isinstance(frequencies, FrequencySweep):
+        return frequencies.chunks(chunk_size)
+    frequencies = np.asarray(frequencies, dtype=float)
+    return (frequencies[i:i + chunk_size] for i in range(0, len(frequencies), chunk_size))
+
+def solve_sweep(frequencies, components, workers=None, chunk_size=None, chunks_per_worker=4, counts=None):
+    """
+    Solve the circuit (ladder sections or a NodalNetwork) over the sweep and yield
+    (frequencies, abcd_matrices) chunks in order.
+    With chunk_size the sweep is evaluated chunk_size frequencies at a time, so memory is
+    bounded by the chunk size as long as each chunk is released once it has been written.
+    With workers > 1 the chunks (by default workers * chunks_per_worker of them) are
+    evaluated in a process pool; otherwise in this process, by default as a single chunk.
+    The work done is added to counts (see count_solved()).
+    """
+    if chunk_size is None:
+        frequencies = np.asarray(frequencies, dtype=float)
+        if not workers or workers <= 1 or len(frequencies) < 2:
+            count_solved(counts, frequencies, components)
+            yield frequencies, solve_circuit(frequencies, components)
+            return
+        chunks = [chunk for chunk in np.array_split(frequencies, workers * chunks_per_worker) if len(chunk)]
+    else:
+        chunks = frequency_chunks(frequencies, chunk_size)
+        if not workers or workers <= 1:
+            for chunk in chunks:
+                count_solved(counts, chunk, components)
+                yield chunk, solve_circuit(chunk, components)
+            return
+
+    with _solve_pool(components, workers) as pool:
+        for chunk, matrices in _pool_chunks(pool, chunks, workers):
+            count_solved(counts, chunk, components)
+            yield chunk, matrices
+
+def _solve_pool(components, workers):
+    # Process pool whose workers each hold the circuit, for _pool_chunks()
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(components,))
+
+def _pool_chunks(pool, chunks, workers):
+    # Results are yielded in submission order, so rows can be streamed straight out. At most
+    # two chunks per worker are in flight, so finished chunks never pile up in memory.
+    pending = deque()
+    for chunk in chunks:
+        pending.append((chunk, pool.submit(_solve_chunk, chunk)))
+        if len(pending) >= 2 * workers:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+    while pending:
+        chunk, future = pending.popleft()
+        yield chunk, future.result()
+
+def memoized_sweep(frequencies, components, responses, digest, workers=None, chunk_size=None, chunks_per_worker=4,
+                   counts=None):
+    """
+    As solve_sweep(), but frequencies already in the ResponseCache responses are not solved
+    again. The frequencies solved by the sweep are merged into the memo once, after the last
+    chunk (and not at all once they outgrow the memo), and with workers > 1 one process pool
+    solves the missing frequencies of every chunk. Only the frequencies actually solved are
+    added to counts.
+    """
+    pools = []      # The process pool, started by the first chunk with frequencies to solve
+
+    def solve(missing):
+        count_solved(counts, missing, components)
+        if not workers or workers <= 1 or len(missing) < 2:
+            return solve_circuit(missing, components)
+        if not pools:
+            pools.append(_solve_pool(components, workers))
+        chunks = [chunk for chunk in np.array_split(missing, workers * chunks_per_worker) if len(chunk)]
+        return np.concatenate([matrices for _, matrices in _pool_chunks(pools[0], chunks, workers)])
+
+    solved, nbytes = [], 0
+    try:
+        for chunk in frequency_chunks(frequencies, chunk_size or max(len(frequencies), 1)):
+            new = []
+            matrices = responses.solve(digest, chunk, solve, new)
+            if solved is not None:
+                nbytes += sum(f.nbytes + m.nbytes for f, m in new)
+                if nbytes <= responses.max_bytes:
+                    solved.extend(new)
+                else:
+                    solved = None   # More than the memo holds; it would only be evicted again
+            yield chunk, matrices
+    finally:
+        for pool in pools:
+            pool.shutdown()
+    if solved:
+        responses.store(digest, np.concatenate([f for f, _ in solved]), np.concatenate([m for _, m in solved]))
+
+def report_progress(done, total):
+    # One-line progress report on stderr, rewritten in place and ended after the last chunk
+    print(f"\rSolved {done} of {total} frequencies ({done / max(total, 1):.0%})",
+          end='\n' if done >= total else '', file=sys.stderr, flush=True)
+
+def adaptive_sweep(frequencies, components, rl, budget, db_tolerance=0.1, phase_tolerance=0.01, log=False, counts=None):
+    """
+    Adaptive sweep: start from the (coarse) frequencies given and repeatedly bisect the
+    intervals over which |Av| changes by more than db_tolerance dB or its phase by more
+    than phase_tolerance radians, worst intervals first, until every interval is within
+    tolerance or budget points have been evaluated. Log sweeps are bisected at the
+    geometric mean. Returns the sorted frequencies and their ABCD matrices. The work done is
+    added to counts (see count_solved()).
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    count_solved(counts, frequencies, components)
+    abcd_matrices = solve_circuit(frequencies, components)
+    while len(frequencies) < budget:
+        av = calculate_output_variables(abcd_matrices, 0, 0, rl, [('Av', '')])['Av']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            db_change = np.abs(np.diff(20 * np.log10(np.abs(av))))
+            phase_change = np.abs(np.angle(av[1:] * np.conj(av[:-1])))
+            error = np.fmax(db_change / db_tolerance, phase_change / phase_tolerance)
+        # Split only the worst intervals each round (within a factor of the largest error),
+        # so the budget goes where the response changes fastest
+        rough = np.flatnonzero((error > 1) & (error >= np.nanmax(error, initial=0) / 4))
+        rough = rough[np.argsort(error[rough], kind='stable')[::-1]][:budget - len(frequencies)]
+        low, high = frequencies[rough], frequencies[rough + 1]
+        middle = np.sqrt(low * high) if log else (low + high) / 2
+        # Intervals already as narrow as floating point allows cannot be split further
+        middle = middle[(middle > low) & (middle < high)]
+        if not len(middle):
+            break
+        frequencies = np.concatenate((frequencies, middle))
+        count_solved(counts, middle, components)
+        abcd_matrices = np.concatenate((abcd_matrices, solve_circuit(middle, components)))
+        order = np.argsort(frequencies, kind='stable')
+        frequencies, abcd_matrices = frequencies[order], abcd_matrices[order]
+    return frequencies, abcd_matrices
@@ -1,8 +1,37 @@
 import unittest
+from unittest import mock
 import numpy as np
 from main import parse_component, parse_net_file, impedance_matrix, cascade_matrices, calculate_output_variables
+from matrix_calculations import impedance_matrices, cascade_matrix_stacks, cascade_ladder, cascade_tree, fold_constant_runs
+from benchmark import generate_ladder, bench_stages, bench_startup, compare_stages
+from net_parser import parse_options, parse_net_stream, parse_net_lines, parse_tolerances, COMPONENT_TYPES
+from sweep import solve_sweep, memoized_sweep, adaptive_sweep, FrequencySweep
+from batch import run_batch
+from csv_writer import write_csv_data_row, write_csv_data_block, output_columns, open_output
+from component_table import ComponentTable
+from circuit_cache import CircuitCache, ResponseCache, circuit_digest
+from tolerance import tolerance_sweep
+from incremental import IncrementalCascade
+from profiling import get_profiler, StageProfiler, NULL_PROFILER
+from autotest import run_autotest, compare_files, split_csv
+from binary_writer import BinaryWriter
+from server import SolveServer
+from nodal import NodalNetwork, is_ladder
+from optimize import MaskOptimizer, read_mask
+import json
 import main
 import os
+import shutil
+import tempfile
+import contextlib
+import subprocess
+import sys
+import io
+
+def numpy_path():
+    # Solve even small sweeps with the NumPy kernels, whose files runs with other options
+    # must match digit for digit; the plain-Python path only agrees with them to rounding
+    return mock.patch('scalar_cascade.SCALAR_MAX_WORK', 0)
 
 class TestCircuitAnalysis(unittest.TestCase):
 
@@ -40,6 +69,553 @@ class TestCircuitAnalysis(unittest.TestCase):
         result = cascade_matrices(matrices)
         np.testing.assert_array_almost_equal(result, expected)
 
+    def test_impedance_matrices(self):
+        # The vectorised matrices must match impedance_matrix() at every frequency
+        frequencies = np.linspace(10, 1e6, 5)
+        for n1, n2, component_type, value in [(1, 2, 'R', 100), (2, 0, 'L', 1e-3), (2, 3, 'C', 1e-9), (3, 0, 'G', 0.02)]:
+            result = impedance_matrices(frequencies, n1, n2, component_type, value)
+            self.assertEqual(result.shape, (5, 2, 2))
+            for f, matrix in zip(frequencies, result):
+                np.testing.assert_allclose(matrix, impedance_matrix(f, n1, n2, component_type, value))
+
+    def test_cascade_matrix_stacks(self):
+        # Stacked cascading must agree with cascading each frequency separately
+        frequencies = np.logspace(1, 6, 4)
+        components = [(1, 2, 'R', 10), (2, 0, 'C', 1e-7), (2, 3, 'L', 1e-3), (3, 0, 'R', 75)]
+        result = cascade_matrix_stacks(impedance_matrices(frequencies, *c) for c in components)
+        for f, matrix in zip(frequencies, result):
+            expected = cascade_matrices([impedance_matrix(f, *c) for c in components])
+            np.testing.assert_allclose(matrix, expected)
+
+    def test_cascade_ladder(self):
+        # The closed-form ladder kernel must agree with the general matrix cascade
+        frequencies = np.linspace(10, 1e7, 6)
+        components = [(1, 2, 'R', 8.55), (2, 0, 'R', 141.9), (2, 3, 'L', 1.59e-3), (3, 0, 'C', 3.18e-9),
+                      (3, 0, 'L', 7.96e-6), (3, 4, 'G', 0.02677), (4, 0, 'G', 0.01)]
+        expected = cascade_matrix_stacks(impedance_matrices(frequencies, *c) for c in components)
+        np.testing.assert_allclose(cascade_ladder(frequencies, components), expected)
+
+    def test_fold_constant_runs(self):
+        # Runs of R/G sections fold into constant matrices without changing the cascade
+        frequencies = np.linspace(10, 1e7, 6)
+        components = [(1, 2, 'R', 8.55), (2, 0, 'R', 141.9), (2, 3, 'L', 1.59e-3), (3, 0, 'G', 0.01),
+                      (3, 0, 'C', 3.18e-9), (3, 4, 'G', 0.02677), (4, 0, 'G', 0.01), (4, 5, 'R', 50)]
+        sections, saved = fold_constant_runs(components)
+        self.assertEqual(saved, 3)
+        self.assertEqual(len(sections), 5)
+        np.testing.assert_allclose(cascade_ladder(frequencies, sections), cascade_ladder(frequencies, components))
+
+        # A purely resistive circuit such as b_Pi_03 folds into a single matrix
+        sections, saved = fold_constant_runs([(1, 0, 'R', 75), (1, 2, 'R', 220), (2, 0, 'R', 150)])
+        self.assertEqual((len(sections), saved), (1, 2))
+
+    def test_incremental_cascade(self):
+        # Each update must give the outputs of a fresh cascade of the edited circuit
+        frequencies = np.linspace(10, 1e6, 8)
+        components = generate_ladder(40)
+        output_data = [('Vout', 'V'), ('Zin', 'Ohms')]
+        solver = IncrementalCascade(frequencies, components, 5, 50, 75, output_data)
+        for index, value in [(17, 2e-4), (17, 3e-4), (3, 5e-9), (60, 2e-9), (-1, 4e-9), (0, 1e-5)]:
+            solver.update_component(index, value)
+            n1, n2, component_type, _ = components[index]
+            components[index] = (n1, n2, component_type, value)
+            expected = calculate_output_variables(cascade_ladder(frequencies, components), 5, 50, 75, output_data)
+            for name, _ in output_data:
+                np.testing.assert_allclose(solver.outputs()[name], expected[name], rtol=1e-9)
+
+    def test_cascade_tree(self):
+        # Tree reduction, with and without a thread pool, must agree with the sequential fold
+        frequencies = np.linspace(10, 1e6, 8)
+        components = generate_ladder(300)
+        expected = cascade_ladder(frequencies, components)
+        np.testing.assert_allclose(cascade_tree(frequencies, components, chunk_size=64), expected, rtol=1e-9)
+        np.testing.assert_allclose(cascade_tree(frequencies, components, workers=2, chunk_size=64), expected, rtol=1e-9)
+
+        # A lossy ladder long enough to overflow the plain product stays finite when rescaled
+        components = generate_ladder(400, series=('R', 1e3), shunt=('R', 1e-3))
+        with np.errstate(over='ignore', invalid='ignore'):
+            self.assertFalse(np.isfinite(cascade_ladder(frequencies, components)).all())
+        total, exponent = cascade_tree(frequencies, components, return_exponent=True)
+        self.assertTrue(np.isfinite(total).all() and np.isfinite(exponent).all())
+        self.assertTrue((exponent > 1024).all())
+
+    def test_bench_stages(self):
+        # Every stage is timed within the limits and slow-downs beyond the threshold are reported
+        records = bench_stages([10, 100], [10], per_frequency_limit=500, log=lambda line: None)
+        stages = [(r['stage'], r['sections'], r['nfreqs']) for r in records]
+        self.assertIn(('solve_per_frequency', 10, 10), stages)
+        self.assertNotIn(('solve_per_frequency', 100, 10), stages)
+        self.assertIn(('write_csv_data_row', None, 10), stages)
+        baseline = [dict(r, seconds=r['seconds'] / 2 - 1e-3) for r in records]
+        self.assertEqual(len(compare_stages(records, baseline)), len(records))
+        self.assertEqual(compare_stages(records, records), [])
+
+        # Command-line start-up is timed next to the bare interpreter
+        records = bench_startup([(1, 10)], log=lambda line: None)
+        self.assertEqual([r['stage'] for r in records], ['startup_python', 'startup_numpy', 'startup_main'])
+
+    def test_lazy_imports(self):
+        # A small linear sweep is solved and written without importing NumPy, the pools or the
+        # nodal and binary backends, and the file passes AutoTest against its model
+        with tempfile.TemporaryDirectory() as tmp:
+            script = ("import sys, main\nmain.main(sys.argv[1], sys.argv[2])\n"
+                      "print(sorted(set(sys.modules) & {'numpy', 'concurrent.futures.process', 'nodal', 'binary_writer'}))")
+            imported = subprocess.run([sys.executable, '-c', script, 'User_files/b_RC.net', f'{tmp}/out.csv'],
+                                      capture_output=True, text=True, check=True).stdout.splitlines()[-1]
+            self.assertEqual(imported, '[]')
+            with open('Model_files/b_RC_model.csv') as model, open(f'{tmp}/out.csv') as out:
+                self.assertFalse(compare_files(io.StringIO(), split_csv(model.read()), out.read(), 1e-3, 1e-12))
+        # Names main.py used to star-import are still found on it
+        self.assertIs(main.impedance_matrix, impedance_matrix)
+
+    def test_parse_net_stream(self):
+        # The streaming parser must agree with parse_net_file() followed by parse_component()
+        input_file = 'User_files/a_Test_Circuit_1.net'
+        circuit_data, terms_data, output_data = parse_net_file(input_file)
+        (n1s, n2s, codes, values), stream_terms, stream_output = parse_net_stream(input_file)
+        expected = [parse_component(line, 'test_output.csv') for line in circuit_data]
+        self.assertEqual(list(zip(n1s, n2s, [COMPONENT_TYPES[c] for c in codes], values)), expected)
+        self.assertEqual(stream_terms, terms_data)
+        self.assertEqual(stream_output, output_data)
+
+        # Malformed lines are reported with their line number
+        with self.assertRaisesRegex(ValueError, "on line 3 not formatted correctly"):
+            parse_net_lines(['<CIRCUIT>', 'n1=1 n2=2 R=10', 'n1=2 n2=0 X=5', '</CIRCUIT>'])
+
+    def test_component_table(self):
+        # The table must sort like sorted() on (n1, n2) and iterate as component tuples
+        components = [(5, 6, 'G', 0.02677), (1, 2, 'R', 8.55), (4, 0, 'C', 3.18e-9), (2, 0, 'R', 141.9), (4, 0, 'L', 7.96e-6)]
+        table = ComponentTable.from_tuples(components)
+        self.assertEqual(list(table.sorted()), sorted(components, key=lambda x: (x[0], x[1])))
+        self.assertEqual(table.mask('R').tolist(), [False, True, False, True, False])
+        self.assertEqual(table.shunt.tolist(), [False, False, True, True, True])
+        self.assertEqual(table[1:3][0], (1, 2, 'R', 8.55))
+        self.assertLessEqual(table.nbytes / len(table), 20)
+
+        # The cascade kernels accept the table directly
+        frequencies = np.linspace(10, 1e6, 7)
+        ladder = ComponentTable.from_tuples(generate_ladder(100))
+        expected = cascade_ladder(frequencies, generate_ladder(100))
+        np.testing.assert_allclose(cascade_ladder(frequencies, ladder), expected)
+        np.testing.assert_allclose(cascade_tree(frequencies, ladder, chunk_size=32), expected, rtol=1e-9)
+
+    def test_circuit_cache(self):
+        # A warm run loads the sorted table from the cache and gives the same output
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = CircuitCache(os.path.join(tmp, 'cache'))
+            with contextlib.redirect_stdout(io.StringIO()), numpy_path():
+                main.run_file('User_files/c_LCR.net', f'{tmp}/plain.csv')
+                main.run_file('User_files/c_LCR.net', f'{tmp}/cold.csv', cache=cache)
+                main.run_file('User_files/c_LCR.net', f'{tmp}/warm.csv', cache=cache)
+            self.assertEqual(len(os.listdir(cache.directory)), 1)
+            for name in ['cold', 'warm']:
+                with open(f'{tmp}/plain.csv') as plain, open(f'{tmp}/{name}.csv') as cached:
+                    self.assertEqual(cached.read(), plain.read())
+
+            # Entries keep the folded R/G runs of ladders, exactly as fold_constant_runs() gives them
+            ladder = ComponentTable.from_tuples([(1, 2, 'R', 10), (2, 0, 'G', 0.01), (2, 3, 'R', 5), (3, 4, 'L', 1e-6),
+                                                 (4, 0, 'C', 1e-9), (4, 5, 'R', 2), (5, 0, 'R', 100)]).sorted()
+            cache.store('ladder', ladder, fold_constant_runs(ladder))
+            table, (sections, saved) = cache.load('ladder')
+            expected, expected_saved = fold_constant_runs(ladder)
+            self.assertEqual((saved, len(table)), (expected_saved, len(ladder)))
+            self.assertTrue(any(isinstance(section, np.ndarray) for section in sections))
+            self.assertEqual(len(sections), len(expected))
+            for section, folded in zip(sections, expected):
+                if isinstance(folded, np.ndarray):
+                    np.testing.assert_array_equal(section, folded)
+                else:
+                    self.assertEqual(section, folded)
+
+            # Least recently used entries are evicted once the size bound is exceeded
+            table = ComponentTable.from_tuples(generate_ladder(50))
+            small = CircuitCache(os.path.join(tmp, 'small'), max_mb=3000 / 2**20)
+            small.store('first', table)
+            os.utime(small.path('first'), (0, 0))
+            small.store('second', table)
+            self.assertIsNone(small.load('first'))
+            self.assertEqual(list(small.load('second')[0]), list(table))
+            self.assertIsNone(small.load('second')[1])
+
+    def test_tolerance_sweep(self):
+        # Sampled values give one row of matrices per sample
+        frequencies = np.linspace(10, 1e6, 5)
+        batched = impedance_matrices(frequencies, 2, 0, 'C', [1e-9, 2e-9, 3e-9])
+        self.assertEqual(batched.shape, (3, 5, 2, 2))
+        np.testing.assert_allclose(batched[1], impedance_matrices(frequencies, 2, 0, 'C', 2e-9))
+
+        # With zero tolerance every percentile band is the nominal response
+        components = [(1, 2, 'R', 8.55), (2, 0, 'C', 3.18e-9), (2, 3, 'L', 1.59e-3), (3, 0, 'G', 0.01)]
+        output_data = [('Vout', 'V'), ('Av', 'dB')]
+        results = calculate_output_variables(cascade_ladder(frequencies, components), 5, 50, 75, output_data)
+        _, _, expected = output_columns(output_data, results)
+        bands = list(tolerance_sweep(frequencies, components, {'R': 0, 'C': 0}, 5, 50, 75, output_data,
+                                     samples=10, sample_chunk=4, frequency_chunk=3))
+        self.assertEqual(len(bands), 2)
+        for column, band in zip(expected, zip(*[b for _, b in bands])):
+            np.testing.assert_allclose(np.concatenate(band, axis=1), np.broadcast_to(column, (3, 5)), rtol=1e-9)
+
+        # Bands widen with the tolerance and stay ordered
+        (_, (vout_re, vout_im, av)), = tolerance_sweep(frequencies, components, parse_tolerances('R=5,C=10'),
+                                                      5, 50, 75, output_data, samples=200, seed=1)
+        self.assertTrue((av[0] < av[2]).all() and (av[0] <= av[1]).all() and (av[1] <= av[2]).all())
+
+    def test_profiling(self):
+        # Profiling is off by default and reports every stage of main() when switched on
+        self.assertIs(get_profiler(), NULL_PROFILER)
+        profiler = StageProfiler()
+        with profiler.stage('build'):
+            data = np.ones(2**18)
+        self.assertEqual(list(profiler.iterate('loop', [1, 2])), [1, 2])
+        self.assertGreaterEqual(profiler.stages['build'][1], data.nbytes)
+        self.assertEqual(profiler.stages['loop'][2], 3)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            report = io.StringIO()
+            with contextlib.redirect_stdout(report):
+                main.run_file('User_files/b_Pi_03.net', f'{tmp}/out.csv', profile=True)
+            for line in ['parse', 'fold', 'cascade', 'outputs', 'write', 'frequencies solved: 10', 'ladder sections applied: 10',
+                         'sections saved by folding: 20']:
+                self.assertIn(line, report.getvalue())
+
+            # Counters measure what was solved: nothing on a warm response cache
+            responses, report = ResponseCache(), io.StringIO()
+            with contextlib.redirect_stdout(report):
+                main.run_file('User_files/b_Pi_03.net', f'{tmp}/cold.csv', responses=responses)
+                main.run_file('User_files/b_Pi_03.net', f'{tmp}/warm.csv', responses=responses, profile=True)
+            self.assertNotIn('frequencies solved', report.getvalue())
+
+        # Nodal analysis solves one system per frequency, and workers' chunks are counted too
+        bridge = NodalNetwork([(1, 2, 'R', 10), (1, 3, 'R', 20), (2, 3, 'R', 30), (2, 0, 'C', 1e-9), (3, 0, 'R', 40)])
+        counts = {}
+        list(solve_sweep(np.linspace(1e3, 1e6, 12), bridge, workers=2, counts=counts))
+        self.assertEqual(counts, {'frequencies solved': 12, 'nodal systems solved': 12})
+
+    def test_solve_server(self):
+        # Concurrent JSON-lines requests are answered by id, reusing parsed circuits
+        with open('User_files/c_LCR.net') as file:
+            net = file.read()
+        with tempfile.TemporaryDirectory() as tmp:
+            requests = [{'id': 1, 'path': 'User_files/c_LCR.net'}, {'id': 2, 'net': net},
+                        {'id': 3, 'net': net, 'output': f'{tmp}/out.csv'}, {'id': 4, 'path': 'User_files/a_Test_Circuit_1BRX.net'}]
+            server = SolveServer(threads=3)
+            responses = io.StringIO()
+            server.serve(io.StringIO("".join(json.dumps(r) + "\n" for r in requests) + "not json\n[1, 2]\n"), responses)
+            lines = responses.getvalue().splitlines()
+            answers = {r['id']: r for r in map(json.loads, lines)}
+
+            # Every line is answered, including those that are not a JSON object
+            self.assertEqual(len(lines), 6)
+            self.assertEqual(sorted(answers, key=str), [1, 2, 3, 4, None])
+            self.assertEqual([r['status'] for r in map(json.loads, lines) if r['id'] is None], [1, 1])
+            self.assertEqual([answers[i]['status'] for i in [1, 2, 3, 4]], [0, 0, 0, 1])
+            self.assertIn("not formatted correctly", answers[4]['messages'])
+            # Profiling is process-wide, so it is not a per-request option
+            with contextlib.redirect_stdout(io.StringIO()) as printed:
+                self.assertEqual(server.handle({'path': 'User_files/c_LCR.net', 'options': {'profile': True}})['status'], 1)
+            self.assertIn("Unknown options: profile", printed.getvalue())
+            with mock.patch.dict(os.environ, {'CASCADE_PROFILE': '1'}):
+                profiled = SolveServer(threads=3)
+            os.rmdir(profiled.scratch)
+            self.assertEqual(profiled.threads, 1)
+            self.assertEqual(answers[1]['results'], answers[2]['results'])
+            self.assertEqual(len(server.cache.entries), 1)
+            with numpy_path():
+                main.run_file('User_files/c_LCR.net', f'{tmp}/expected.csv')
+            with open(f'{tmp}/out.csv') as out, open(f'{tmp}/expected.csv') as expected:
+                self.assertEqual(out.read(), expected.read())
+            data = np.array(answers[1]['results']['data'])
+            np.testing.assert_allclose(data, np.loadtxt(f'{tmp}/expected.csv', delimiter=',', skiprows=2,
+                                                        usecols=range(data.shape[1])), rtol=1e-3)
+
+    def test_parse_options(self):
+        # Options are split from the positional arguments and converted
+        self.assertEqual(parse_options(['in.net', '--workers', '4', 'out.csv']), (['in.net', 'out.csv'], {'workers': 4}))
+        with self.assertRaises(ValueError):
+            parse_options(['--bogus', 'in.net', 'out.csv'])
+        with self.assertRaises(ValueError):
+            parse_options(['in.net', 'out.csv', '--workers'])
+        self.assertEqual(parse_options(['--tolerance', 'R=5,C=10'])[1], {'tolerance': {'R': 0.05, 'C': 0.1}})
+        with self.assertRaises(ValueError):
+            parse_options(['--tolerance', 'X=5'])
+
+    def test_solve_sweep_workers(self):
+        # A process-pool sweep must return the same matrices, in order, as a single chunk
+        frequencies = np.linspace(10, 1e6, 50)
+        components = generate_ladder(20)
+        chunks = list(solve_sweep(frequencies, components, workers=2))
+        self.assertGreater(len(chunks), 1)
+        np.testing.assert_array_equal(np.concatenate([f for f, _ in chunks]), frequencies)
+        np.testing.assert_array_equal(np.concatenate([m for _, m in chunks]), cascade_ladder(frequencies, components))
+
+    def test_chunked_sweep(self):
+        # Sweep points computed chunk by chunk are exactly those of np.linspace/np.logspace
+        for sweep, expected in [(FrequencySweep(10, 1e7, 1001), np.linspace(10, 1e7, 1001)),
+                                (FrequencySweep(1, 7, 999, log=True), np.logspace(1, 7, 999))]:
+            np.testing.assert_array_equal(np.concatenate(list(sweep.chunks(97))), expected)
+            np.testing.assert_array_equal(np.asarray(sweep), expected)
+
+        # Chunked solves, in this process or a pool, stream the same matrices in order
+        components = generate_ladder(20)
+        sweep = FrequencySweep(10, 1e6, 50)
+        expected = cascade_ladder(np.asarray(sweep), components)
+        for workers in [None, 2]:
+            chunks = list(solve_sweep(sweep, components, workers, chunk_size=7))
+            self.assertEqual([len(f) for f, _ in chunks], [7] * 7 + [1])
+            np.testing.assert_array_equal(np.concatenate([m for _, m in chunks]), expected)
+
+        # Chunked runs write the same CSV, and .npy outputs are written through a memory map
+        with tempfile.TemporaryDirectory() as tmp:
+            with contextlib.redirect_stderr(io.StringIO()) as progress:
+                main.run_file('User_files/c_LCR.net', f'{tmp}/chunked.csv', chunk_size=7)
+                main.run_file('User_files/c_LCR.net', f'{tmp}/chunked.npy', chunk_size=7)
+            with numpy_path():
+                main.run_file('User_files/c_LCR.net', f'{tmp}/whole.csv')
+            main.run_file('User_files/c_LCR.net', f'{tmp}/whole.npy')
+            self.assertIn("(100%)", progress.getvalue())
+            with open(f'{tmp}/chunked.csv') as chunked, open(f'{tmp}/whole.csv') as whole:
+                self.assertEqual(chunked.read(), whole.read())
+            np.testing.assert_array_equal(np.load(f'{tmp}/chunked.npy'), np.load(f'{tmp}/whole.npy'))
+
+    def test_nodal_analysis(self):
+        # On ladders nodal analysis agrees with the cascade, which main() keeps using for them
+        frequencies = np.logspace(1, 6, 40)
+        for components in [generate_ladder(12), [(1, 2, 'R', 50), (2, 0, 'C', 1e-6), (2, 3, 'L', 1e-3), (3, 0, 'G', 20)]]:
+            self.assertTrue(is_ladder(components))
+            np.testing.assert_allclose(NodalNetwork(components).abcd(frequencies), cascade_ladder(frequencies, components),
+                                       rtol=1e-9, atol=1e-12)
+
+        # Parallel series elements and a bridge across two nodes are not ladders
+        parallel = [(1, 2, 'R', 100), (1, 2, 'R', 300)]
+        bridged = [(1, 2, 'R', 100), (2, 3, 'L', 1e-3), (1, 3, 'R', 1000), (3, 0, 'C', 1e-9)]
+        self.assertFalse(is_ladder(parallel))
+        self.assertFalse(is_ladder(bridged))
+        np.testing.assert_allclose(NodalNetwork(parallel).abcd(frequencies), np.broadcast_to([[1, 75], [0, 1]], (40, 2, 2)))
+        # The bridge is in parallel with the series chain, followed by the shunt capacitor
+        w = 2 * np.pi * frequencies
+        z = 1 / (1 / (100 + 1j * w * 1e-3) + 1 / 1000)
+        y = 1j * w * 1e-9
+        expected = np.stack((np.stack((1 + z * y, z), axis=-1), np.stack((y, np.ones_like(y)), axis=-1)), axis=-2)
+        np.testing.assert_allclose(NodalNetwork(bridged).abcd(frequencies), expected)
+
+        # main() switches to nodal analysis for the bridged circuit
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(f'{tmp}/bridged.net', 'w') as net:
+                net.write("<CIRCUIT>\n" + "".join(f"n1={a} n2={b} {t}={v}\n" for a, b, t, v in bridged) + "</CIRCUIT>\n"
+                          "<TERMS>\nVT=1 RS=50\nRL=1e4\nLFstart=10 LFend=1e6 Nfreqs=40\n</TERMS>\n<OUTPUT>\nAv\n</OUTPUT>\n")
+            main.run_file(f'{tmp}/bridged.net', f'{tmp}/bridged.npz')
+            with np.load(f'{tmp}/bridged.npz') as results:
+                av = results['data'][:, 1] + 1j * results['data'][:, 2]
+            np.testing.assert_allclose(av, 1e4 / (expected[:, 0, 0] * 1e4 + expected[:, 0, 1]))
+
+    def test_response_cache(self):
+        # Overlapping sweeps only solve the frequencies not seen before, with the same results
+        components = generate_ladder(10)
+        solved = []
+        def solve(frequencies):
+            solved.append(frequencies)
+            return cascade_ladder(frequencies, components)
+        responses = ResponseCache()
+        first, second = np.linspace(1e4, 1e6, 100), np.linspace(1e4, 2e6, 200)
+        np.testing.assert_array_equal(responses.solve('ladder', first, solve), cascade_ladder(first, components))
+        np.testing.assert_array_equal(responses.solve('ladder', second, solve), cascade_ladder(second, components))
+        np.testing.assert_array_equal(solved[1], np.setdiff1d(second, first))
+        self.assertEqual((responses.hits, responses.misses), (100, 200))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # The memo is written to a file and read back by a new cache
+            responses.save(f'{tmp}/responses.npz')
+            restored = ResponseCache(f'{tmp}/responses.npz')
+            np.testing.assert_array_equal(restored.solve('ladder', second, None), cascade_ladder(second, components))
+            self.assertEqual(restored.misses, 0)
+
+            # Least recently used circuits are evicted past the memory bound
+            small = ResponseCache(max_mb=1.5 * 9 * first.nbytes / 2**20)   # Room for one entry: frequencies and 2x2 complex matrices
+            small.solve('a', first, solve)
+            small.solve('b', first, solve)
+            self.assertEqual(list(small.entries), ['b'])
+
+            # main() reuses the responses of an earlier run of the same circuit
+            table = ComponentTable.from_tuples(components).sorted()
+            self.assertEqual(circuit_digest(table), circuit_digest(ComponentTable.from_tuples(components).sorted()))
+            responses = ResponseCache()
+            main.run_file('User_files/c_LCR.net', f'{tmp}/first.csv', responses=responses)
+            main.run_file('User_files/c_LCR.net', f'{tmp}/second.csv', responses=responses, chunk_size=7)
+            self.assertEqual((responses.hits, responses.misses), (50, 50))
+            with open(f'{tmp}/first.csv') as first_file, open(f'{tmp}/second.csv') as second_file:
+                self.assertEqual(first_file.read(), second_file.read())
+
+        # A chunked sweep merges what it solved into the memo once, after its last chunk
+        responses, stores = ResponseCache(), []
+        store = responses.store
+        responses.store = lambda *args: stores.append(args[0]) or store(*args)
+        for workers in [None, 2]:
+            chunks = list(memoized_sweep(second, components, responses, f'chunked{workers}', workers, chunk_size=30))
+            np.testing.assert_array_equal(np.concatenate([m for _, m in chunks]), cascade_ladder(second, components))
+        self.assertEqual(stores, ['chunkedNone', 'chunked2'])
+        self.assertEqual(len(responses.entries['chunked2'][0]), 200)
+
+    def test_adaptive_sweep(self):
+        # Points are added to the sweep of a lightly loaded LC low-pass, sorted and within the budget
+        components = [(1, 2, 'L', 1e-3), (2, 0, 'C', 1e-9)]
+        coarse = np.logspace(3, 7, 20)
+        frequencies, abcd_matrices = adaptive_sweep(coarse, components, 1e4, 300, log=True)
+        self.assertLessEqual(len(frequencies), 300)
+        self.assertGreater(len(frequencies), len(coarse))
+        self.assertTrue((np.diff(frequencies) > 0).all())
+        self.assertTrue(np.isin(coarse, frequencies).all())
+        np.testing.assert_allclose(abcd_matrices, cascade_ladder(frequencies, components))
+
+        # Around the resonance peak the refined points track |Av| more closely than a uniform sweep of the same size
+        dense = np.logspace(3, 7, 20000)
+        def av_db(f):
+            av = calculate_output_variables(cascade_ladder(f, components), 0, 0, 1e4, [('Av', '')])['Av']
+            return 20 * np.log10(np.abs(av))
+        uniform = np.logspace(3, 7, len(frequencies))
+        adaptive_error = np.abs(np.interp(dense, frequencies, av_db(frequencies)) - av_db(dense)).max()
+        uniform_error = np.abs(np.interp(dense, uniform, av_db(uniform)) - av_db(dense)).max()
+        self.assertLess(adaptive_error, uniform_error / 5)
+
+    def test_run_batch(self):
+        # Batch mode must write the same files as solving each netlist on its own
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ['b_RC', 'a_Test_Circuit_1BRX']:
+                shutil.copy(f'User_files/{name}.net', tmp)
+            with contextlib.redirect_stdout(io.StringIO()):
+                failed = run_batch(tmp, os.path.join(tmp, 'out'))
+                main.run_file(f'{tmp}/b_RC.net', f'{tmp}/b_RC.csv')
+            self.assertEqual(failed, 1)
+            with open(f'{tmp}/out/b_RC.csv') as batch_file, open(f'{tmp}/b_RC.csv') as single_file:
+                self.assertEqual(batch_file.read(), single_file.read())
+            self.assertEqual(os.path.getsize(f'{tmp}/out/a_Test_Circuit_1BRX.csv'), 0)
+
+    def test_run_autotest(self):
+        # Cases are solved in a pool, compared with their models and logged next to the outputs
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ['b_RC', 'c_LCR']:
+                os.makedirs(f'{tmp}/User_files', exist_ok=True)
+                os.makedirs(f'{tmp}/Model_files', exist_ok=True)
+                shutil.copy(f'User_files/{name}.net', f'{tmp}/User_files')
+                shutil.copy(f'Model_files/{name}_model.csv', f'{tmp}/Model_files')
+            with open(f'{tmp}/Model_files/c_LCR_model.csv') as model:
+                lines = model.read().splitlines(True)
+            fields = lines[4].split(',')
+            fields[1] = '  9.999e+09'
+            lines[4] = ','.join(fields)
+            with open(f'{tmp}/Model_files/c_LCR_model.csv', 'w') as model:
+                model.writelines(lines)
+            with contextlib.redirect_stdout(io.StringIO()):
+                incorrect = run_autotest(1e-13, 1e-13, 2, f'{tmp}/User_files', f'{tmp}/Model_files',
+                                         [('B', ['b_RC']), ('C', ['c_LCR'])])
+            self.assertEqual(incorrect, 1)
+            with open(f'{tmp}/User_files/c_LCR_compare.log') as log:
+                text = log.read()
+            self.assertIn("Line 5 variable 1 differs", text)
+            self.assertIn("Error found in line 5 from character", text)
+            self.assertIn("Line 6 is OK", text)
+
+        # Rows that cannot be parsed as one array are compared line by line
+        log = io.StringIO()
+        model = split_csv("F,\nHz,\n 1.0, 2.0,\n")
+        self.assertTrue(compare_files(log, model, "F,\nHz,\n 1.0, x,\n", 1e-13, 1e-13))
+        self.assertIn("Line 3 contains a value that is not a float", log.getvalue())
+
+    def test_write_csv_data_block(self):
+        # The block writer must produce exactly the text of the row-by-row writer
+        rng = np.random.default_rng(1)
+        frequencies = np.logspace(1, 7, 200)
+        values = np.exp(rng.uniform(-40, 40, (3, 200))) * np.exp(2j * np.pi * rng.random((3, 200)))
+        values[0, :5] = [0, -0.0, np.nan, np.inf, 1e-300]
+        results = {'Vin': values[0], 'Av': values[1], 'Zin': values[2]}
+        output_data = [('Vin', 'V'), ('Av', 'dB'), ('Vin', 'dBV'), ('Zin', 'Ohms'), ('Ap', 'dB')]
+        rows, block = io.StringIO(), io.StringIO()
+        for i, f in enumerate(frequencies):
+            write_csv_data_row(rows, f, output_data, {name: value[i] for name, value in results.items()})
+        write_csv_data_block(block, frequencies, output_data, results, block_rows=64)
+        self.assertEqual(block.getvalue(), rows.getvalue())
+
+    def test_output_variables_on_demand(self):
+        # Only the requested variables are returned, as arrays equal to the full evaluation
+        frequencies = np.linspace(10, 1e6, 6)
+        abcd_matrices = cascade_ladder(frequencies, generate_ladder(5))
+        everything = calculate_output_variables(abcd_matrices, 5, 50, 75)
+        self.assertEqual(len(everything), 17)
+        requested = calculate_output_variables(abcd_matrices, 5, 50, 75, [('Pout', 'W'), ('Av', 'dB'), ('Bogus', 'V')])
+        self.assertEqual(list(requested), ['Pout', 'Av'])
+        for name, values in requested.items():
+            self.assertEqual(values.shape, frequencies.shape)
+            np.testing.assert_array_equal(values, everything[name])
+        np.testing.assert_allclose(everything['Ap'], everything['Pout'] / everything['Pin'])
+
+    def test_s_parameters(self):
+        # A 50 Ohm series resistor between 50 Ohm references, and several terminations from one cascade
+        s = calculate_output_variables(np.array([[1, 50], [0, 1]]), 1, 50, 50)
+        for name, expected in [('S11', 1 / 3), ('S21', 2 / 3), ('S12', 2 / 3), ('S22', 1 / 3), ('RetLoss', 3), ('InsLoss', 1.5)]:
+            self.assertAlmostEqual(complex(s[name]), expected)
+        with tempfile.TemporaryDirectory() as tmp:
+            net_file = f'{tmp}/s.net'
+            with open('User_files/c_LCR.net') as source, open(net_file, 'w') as target:
+                target.write(source.read().replace('Ai\n', 'Ai\nS11 dB\nS21\nRetLoss dB\nInsLoss dB\n'))
+            with numpy_path():
+                self.assertEqual(main.run_file(net_file, f'{tmp}/single.csv'), 0)
+            self.assertEqual(main.run_file(net_file, f'{tmp}/out.csv', terminations=[(50, 50), (75, 1e3)]), 0)
+            with open(f'{tmp}/single.csv') as single, open(f'{tmp}/out_RS50_RL50.csv') as first:
+                self.assertEqual(single.read(), first.read())
+            self.assertTrue(os.path.exists(f'{tmp}/out_RS75_RL1000.csv'))
+            # Return loss is -20 log10|S11|
+            data = np.loadtxt(f'{tmp}/single.csv', delimiter=',', skiprows=2, usecols=range(26))
+            np.testing.assert_allclose(data[:, 24], -data[:, 21], rtol=1e-3)
+        self.assertEqual(parse_options(['--terminations', '50:50,75:1e3'])[1]['terminations'], [(50, 50), (75, 1000)])
+
+    def test_mask_optimizer(self):
+        # The analytic Jacobian agrees with finite differences, and d_LPF_B50 is tuned to a tighter mask
+        components = [(1, 2, 'L', 15.9e-6), (2, 0, 'C', 12.7e-9), (2, 3, 'R', 5), (3, 4, 'L', 15.9e-6), (4, 0, 'G', 0.01)]
+        frequencies = np.linspace(1e4, 3e6, 40)
+        mask = [(name, 1e4, 3e6, 10, 20) for name in ['Av', 'Zin', 'Pout', 'S11']]
+        optimizer = MaskOptimizer(frequencies, components, mask, 5, 50, 75)
+        log_values = np.log([c[3] for c in components])
+        _, jacobian = optimizer.evaluate(log_values)
+        for k in range(len(components)):
+            step = np.zeros(len(components))
+            step[k] = 1e-6
+            difference = (optimizer.evaluate(log_values + step)[0] - optimizer.evaluate(log_values - step)[0]) / 2e-6
+            np.testing.assert_allclose(jacobian[:, k], difference, rtol=1e-5, atol=1e-8)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(f'{tmp}/mask.txt', 'w') as file:
+                file.write("# pass band and stop band\nS21 10 1.2e6 -1 -\nS21 3e6 10e6 - -25\n")
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                self.assertEqual(main.run_file('User_files/d_LPF_B50.net', f'{tmp}/out.csv', optimize=f'{tmp}/mask.txt', tune=['L', 'C']), 0)
+            self.assertIn('(mask met)', output.getvalue())
+            components = [(1, 2, 'L', 15.9e-6), (2, 0, 'C', 12.7e-9), (2, 3, 'L', 15.9e-6)]
+            optimizer = MaskOptimizer(np.linspace(10, 10e6, 50), components, read_mask(f'{tmp}/mask.txt'), 5, 50, 50, ['L', 'C'])
+            tuned = optimizer.run()
+            self.assertEqual(optimizer.violation, 0)
+            self.assertFalse(optimizer.evaluate(np.log(tuned.values[optimizer.tuned]))[0].any())
+            with open(f'{tmp}/bad.txt', 'w') as file:
+                file.write("Bogus 10 1e6 -1 1\n")
+            with self.assertRaises(ValueError):
+                read_mask(f'{tmp}/bad.txt')
+        self.assertEqual(parse_options(['--tune', 'L,C'])[1]['tune'], ['L', 'C'])
+
+    def test_binary_output(self):
+        # .npy and .npz outputs hold the CSV columns; other extensions still give the CSV
+        with tempfile.TemporaryDirectory() as tmp:
+            for extension in ['csv', 'npy', 'npz']:
+                with numpy_path():
+                    self.assertEqual(main.run_file('User_files/a_Test_Circuit_1dB.net', f'{tmp}/out.{extension}'), 0)
+            with open_output(f'{tmp}/other.csv', []) as writer:
+                self.assertNotIsInstance(writer, BinaryWriter)
+            expected = np.loadtxt(f'{tmp}/out.csv', delimiter=',', skiprows=2, usecols=range(16))
+            with np.load(f'{tmp}/out.npz') as npz:
+                np.testing.assert_allclose(npz['data'], expected, rtol=1e-3)
+                self.assertEqual(npz['headers'][1], '|Vin|')
+                self.assertEqual(npz['units'][1], 'dBV')
+            records = np.load(f'{tmp}/out.npy', mmap_mode='r')
+            self.assertEqual(records.dtype.names[:2], ('Freq [Hz]', '|Vin| [dBV]'))
+            np.testing.assert_allclose(records['Re(Iout) [A]'], expected[:, 4], rtol=1e-3)
+
     def test_calculate_output_variables(self):
         abcd_matrix = np.array([[1, 0], [0, 1]])  # Identity matrix, implying no transformation
         vt, rs, rl = 10, 50, 100
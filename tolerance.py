@@ -0,0 +1,65 @@
+### Libraries ###
+import numpy as np
+
+### Local Modules ###
+from matrix_calculations import impedance_matrices, cascade_matrix_stacks, calculate_output_variables
+from csv_writer import output_columns
+
+DEFAULT_SAMPLES = 1000
+PERCENTILES = (5, 50, 95)
+
+def draw_samples(components, tolerances, samples, rng):
+    # Component values for every sample as a (Ncomp, K) array, each drawn uniformly within
+    # +/- the tolerance of its component type (types without a tolerance keep their value)
+    nominal = np.array([float(c[3]) for c in components])
+    spread = np.array([tolerances.get(c[2], 0.0) for c in components])
+    factors = rng.uniform(-1, 1, (len(nominal), samples)) * spread[:, np.newaxis]
+    return nominal[:, np.newaxis] * (1 + factors)
+
+def tolerance_sweep(frequencies, components, tolerances, vt, rs, rl, output_data, samples=DEFAULT_SAMPLES,
+                    seed=None, percentiles=PERCENTILES, sample_chunk=256, frequency_chunk=1024):
+    """
+    Monte Carlo tolerance analysis: draw K sets of component values and cascade all
+    K x Nfreqs circuits as batched (samples, frequencies, 2, 2) matrix stacks. The sweep is
+    processed in chunks of sample_chunk samples by frequency_chunk frequencies, so memory
+    stays bounded however large K and Nfreqs are.
+    Yields (frequencies, bands) per frequency chunk, where bands has one
+    (len(percentiles), Nchunk) array per output column.
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    components = list(components)
+    values = draw_samples(components, tolerances, samples, np.random.default_rng(seed))
+
+    for start in range(0, len(frequencies), frequency_chunk):
+        chunk = frequencies[start:start + frequency_chunk]
+        columns = None
+        for first in range(0, samples, sample_chunk):
+            last = min(first + sample_chunk, samples)
+            stacks = (impedance_matrices(chunk, n1, n2, component_type, sampled[first:last])
+                      for (n1, n2, component_type, _), sampled in zip(components, values))
+            total_matrices = cascade_matrix_stacks(stacks)
+            results = calculate_output_variables(total_matrices, vt, rs, rl, output_data)
+            _, _, block = output_columns(output_data, results)
+            if columns is None:
+                columns = [np.empty((samples,) + chunk.shape) for _ in block]
+            for column, data in zip(columns, block):
+                column[first:last] = data
+        yield chunk, [np.percentile(column, percentiles, axis=0) for column in columns]
+
+def write_tolerance_csv(csvfile, frequencies, components, tolerances, vt, rs, rl, output_data,
+                        samples=DEFAULT_SAMPLES, seed=None, percentiles=PERCENTILES):
+    # Write the percentile bands of every output column, one row per frequency, in the
+    # fixed-width layout of the sweep CSV
+    headers, units, _ = output_columns(output_data, {name: 0j for name, _ in output_data})
+    band_headers, band_units = ['      Freq'], ['        Hz']
+    for header, unit in zip(headers, units):
+        band_headers.extend("{:>11}".format(f"P{p} {header}") for p in percentiles)
+        band_units.extend("{:>11}".format(unit) for _ in percentiles)
+    csvfile.write(",".join(band_headers) + "\n")
+    csvfile.write(",".join(band_units) + "\n")
+
+    for chunk, bands in tolerance_sweep(frequencies, components, tolerances, vt, rs, rl, output_data,
+                                        samples, seed, percentiles):
+        rows = np.column_stack([chunk] + [band.T for band in bands])
+        row_format = " %.3e," + ",".join([" %10.3e"] * (rows.shape[1] - 1) + [""]) + "\n"
+        csvfile.write("".join([row_format % tuple(row) for row in rows.tolist()]))